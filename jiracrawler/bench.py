@@ -0,0 +1,248 @@
+"""Crawler benchmarks which don't need a JIRA server
+
+Crawls run against FakeJiraService serving a synthetic project or a
+recorded fixture, each crawl in its own process so peak memory of one
+doesn't hide the other. The fixture and the fake service take memory of
+their own, peak memory of a crawl is measured on top of it.
+"""
+
+import json
+import os
+import resource
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from multiprocessing import Process, Queue
+from optparse import OptionParser
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import aliased, sessionmaker
+
+from jiracrawler.crawler import JiraCrawler
+from jiracrawler.fake import (FakeJiraConnection, FakeJiraService, RecordingService,
+    load_fixture, save_fixture, synthetic_project)
+from jiracrawler.model import Base, Issue, Worklog, Status
+from jiracrawler.store import BulkWriter
+
+
+class StatementCounter(object):
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def synthetic_rows(issues, worklogs_per_issue):
+    created_at = datetime(2011, 1, 1)
+    for i in range(1, issues + 1):
+        issue = {'id': i, 'key': 'BENCH-%d' % i, 'type': 'Task', 'subtask': False,
+            'summary': 'Issue %d' % i, 'assignee': 'dev', 'created_at': created_at,
+            'due_date': None, 'status_id': 1, 'fix_version_id': None}
+        worklogs = [{'id': i * worklogs_per_issue + j, 'created_at': created_at + timedelta(days=j),
+            'author': 'dev', 'time_spent': 3600, 'issue_id': i} for j in range(worklogs_per_issue)]
+        yield (issue, worklogs)
+
+
+def store_merged(session, rows, batch_size):
+    """Per-row persistence the crawler used before bulk upserts"""
+    for (issue, worklogs) in rows:
+        issue_model = session.query(Issue).get(issue['id']) or Issue(id=issue['id'])
+        for (name, value) in issue.items():
+            setattr(issue_model, name, value)
+        issue_model = session.merge(issue_model)
+        for worklog in worklogs:
+            worklog_model = session.query(Worklog).get(worklog['id']) or Worklog(id=worklog['id'])
+            for (name, value) in worklog.items():
+                setattr(worklog_model, name, value)
+            session.merge(worklog_model)
+
+
+def store_bulk(session, rows, batch_size):
+    writer = BulkWriter(session, [Issue.__table__, Worklog.__table__], batch_size)
+    for (issue, worklogs) in rows:
+        writer.add(Issue.__table__, issue)
+        for worklog in worklogs:
+            writer.add(Worklog.__table__, worklog)
+    writer.flush()
+
+
+def persistence_benchmark(store, issues=1000, worklogs_per_issue=3, batch_size=500):
+    """Returns numbers of SQL statements for the initial and the repeated store"""
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add(Status(id=1, name='Open'))
+    session.commit()
+
+    counter = StatementCounter(engine)
+    result = []
+    for run in range(2):
+        counter.count = 0
+        store(session, synthetic_rows(issues, worklogs_per_issue), batch_size)
+        session.commit()
+        result.append(counter.count)
+    return result
+
+
+def run_crawl(fixture, db_path, full, latency=0, options=None, single_pass=False):
+    """Crawls the fixture into SQLite database, returns measurements of the crawl"""
+    service = FakeJiraService(fixture, latency)
+    fake_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    config = dict(options or {}, db_url='sqlite:///%s' % db_path)
+
+    crawler = JiraCrawler(connect=lambda: FakeJiraConnection(service, config))
+    try:
+        crawler.update_statuses()
+        crawler.update_issues_and_worklogs(full=full, single_pass=single_pass)
+    finally:
+        crawler.close()
+    crawler.stats.finish()
+
+    report = crawler.stats.report()
+    return {
+        'wall_time': round(report['seconds'], 3),
+        'rpc': crawler.stats.rpc_calls(),
+        'rpc_by_method': dict((method, rpc['calls']) for (method, rpc) in report['rpc'].items()),
+        'sql': report['sql']['statements'],
+        'phases': report['phases'],
+        'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - fake_memory,
+        'fake_memory_kb': fake_memory,
+    }
+
+
+def run_isolated(target, *args):
+    """Runs function in a child process and returns its result"""
+    results = Queue()
+
+    def run():
+        try:
+            results.put((True, target(*args)))
+        except Exception, e:
+            results.put((False, repr(e)))
+
+    process = Process(target=run)
+    process.start()
+    (ok, result) = results.get()
+    process.join()
+    if not ok:
+        raise RuntimeError(result)
+    return result
+
+
+def make_fixture(issues, versions, fixture_path):
+    if fixture_path:
+        return load_fixture(fixture_path)
+    return synthetic_project(issues=issues, versions=versions)
+
+
+def crawl_benchmark(issues, versions=10, latency=0, options=None, single_pass=False,
+        fixture_path=None):
+    """Returns measurements of full and repeated crawls of the same project"""
+    def crawl(full, db_path):
+        fixture = make_fixture(issues, versions, fixture_path)
+        return run_crawl(fixture, db_path, full, latency, options, single_pass)
+
+    workdir = tempfile.mkdtemp(prefix='jiracrawler-bench-')
+    try:
+        db_path = os.path.join(workdir, 'bench.db')
+        return {
+            'issues': issues,
+            'full': run_isolated(crawl, True, db_path),
+            'repeat': run_isolated(crawl, False, db_path),
+        }
+    finally:
+        shutil.rmtree(workdir)
+
+
+def record(profile_name, fixture_path):
+    """Crawls project of the profile saving JIRA responses as fixture"""
+    from jirareports.common import JiraConnection
+
+    workdir = tempfile.mkdtemp(prefix='jiracrawler-record-')
+    try:
+        jira_con = JiraConnection(profile_name=profile_name)
+        recorder = RecordingService(jira_con.service)
+        jira_con.service = recorder
+        jira_con.config = dict(jira_con.config, worklog_workers='1',
+            db_url='sqlite:///%s' % os.path.join(workdir, 'record.db'))
+
+        crawler = JiraCrawler(connect=lambda: jira_con)
+        crawler.update_statuses()
+        crawler.update_issues_and_worklogs(full=True)
+
+        parent = aliased(Issue)
+        recorder.fixture['parents'] = dict(crawler.session.query(Issue.key, parent.key)\
+            .join((parent, Issue.parent_id == parent.id)))
+        save_fixture(recorder.fixture, fixture_path)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--sizes", default="1000,10000,100000",
+        help="comma separated numbers of issues in synthetic projects")
+    parser.add_option("--versions", type="int", default=10,
+        help="number of versions in synthetic projects")
+    parser.add_option("--latency", type="float", default=0,
+        help="seconds every JIRA call takes")
+    parser.add_option("--fixture", help="crawl fixture file instead of synthetic projects")
+    parser.add_option("--record", metavar="PROFILE",
+        help="record fixture file crawling project of the profile")
+    parser.add_option("--single-pass", action="store_true", default=False)
+    parser.add_option("-o", "--option", action="append", default=[], metavar="NAME=VALUE",
+        help="profile option of the crawler, e.g. worklog_workers=4")
+    parser.add_option("--json", action="store_true", default=False,
+        help="print results as JSON")
+    parser.add_option("--persistence", action="store_true", default=False,
+        help="compare SQL statements of per-row and bulk persistence")
+    parser.add_option("--issues", type="int", default=1000)
+    parser.add_option("--worklogs", type="int", default=3, help="worklogs per issue")
+    parser.add_option("--batch-size", type="int", default=500)
+    (options, args) = parser.parse_args()
+
+    if options.record:
+        if not options.fixture:
+            parser.error("--record needs --fixture to save the recording to")
+        record(options.record, options.fixture)
+        return
+
+    if options.persistence:
+        print "SQL statements storing %s issues with %s worklogs each" % (
+            options.issues, options.worklogs)
+        print "%-10s %10s %10s" % ("", "initial", "repeated")
+        for (name, store) in (("merge", store_merged), ("bulk", store_bulk)):
+            (initial, repeated) = persistence_benchmark(store, options.issues,
+                options.worklogs, options.batch_size)
+            print "%-10s %10s %10s" % (name, initial, repeated)
+        return
+
+    crawler_options = dict(o.split('=', 1) for o in options.option)
+    if options.fixture:
+        sizes = [len(load_fixture(options.fixture)['issues'])]
+    else:
+        sizes = [int(size) for size in options.sizes.split(',')]
+
+    results = []
+    if not options.json:
+        print "%-8s %-7s %10s %10s %10s %12s %12s" % (
+            "issues", "crawl", "seconds", "rpc", "sql", "peak kb", "fake kb")
+    for size in sizes:
+        result = crawl_benchmark(size, options.versions, options.latency, crawler_options,
+            options.single_pass, options.fixture)
+        results.append(result)
+        if not options.json:
+            for crawl in ('full', 'repeat'):
+                print "%-8s %-7s %10s %10s %10s %12s %12s" % (size, crawl,
+                    result[crawl]['wall_time'], result[crawl]['rpc'], result[crawl]['sql'],
+                    result[crawl]['peak_memory_kb'], result[crawl]['fake_memory_kb'])
+
+    if options.json:
+        print json.dumps(results, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from jiracrawler.model import MetadataCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class SharedMetadata(object):
+    """In-process cache of JIRA metadata shared by crawlers of several projects
+
+    Values are fetched once per key even when crawlers ask concurrently.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def get(self, key, fetch):
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = fetch()
+            return self.values[key]
+
+    def invalidate(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+
+class StoredMetadata(object):
+    """JIRA metadata cached in the crawler's database for ttl seconds
+
+    Values have to be JSON serializable, tuples come back as lists. A ttl
+    of 0 disables the cache.
+    """
+
+    def __init__(self, session, ttl):
+        self.session = session
+        self.ttl = ttl
+
+    def get(self, key, fetch, refresh=False):
+        if self.ttl and not refresh:
+            entry = self.session.query(MetadataCache).get(key)
+            if entry and datetime.now() - entry.fetched_at < timedelta(seconds=self.ttl):
+                return json.loads(entry.value)
+
+        value = fetch()
+        if self.ttl:
+            self.session.merge(MetadataCache(key=key, value=json.dumps(value),
+                fetched_at=datetime.now()))
+        return value
+
+    def clear(self):
+        logger.info("Clearing cached JIRA metadata")
+        self.session.query(MetadataCache).delete()
@@ -0,0 +1,31 @@
+"""Profiles of the JIRA configuration file"""
+
+import os
+from ConfigParser import RawConfigParser
+
+from jirareports.common import JiraConnection
+
+from jiracrawler.rest import RestConnection
+
+
+CONFIG_PATH = os.path.expanduser('~/.jira')
+
+
+def read_profiles(path=CONFIG_PATH):
+    """Returns options of every profile in the JIRA configuration file
+
+    Values are read as written, e.g. passwords may contain %.
+    """
+    parser = RawConfigParser()
+    parser.read(path)
+    return dict((name, dict(parser.items(name))) for name in parser.sections())
+
+
+def jira_connection(profile_name=None, profiles=None):
+    """Returns connection to JIRA API of the profile, SOAP unless its api option is rest"""
+    if profiles is None:
+        profiles = read_profiles()
+    config = profiles.get(profile_name or 'default', {})
+    if config.get('api', 'soap').lower() == 'rest':
+        return RestConnection(config)
+    return JiraConnection(profile_name=profile_name)
@@ -2,228 +2,1040 @@
 
 import sys
 
+import copy
 import logging
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import partial
+from logging.handlers import WatchedFileHandler
+from optparse import OptionParser
 
-from sqlalchemy import create_engine, and_
+from sqlalchemy import and_, bindparam, select
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import IntegrityError
 
-from jiracrawler.model import Base, Version, Issue, Worklog, Status
-from jirareports.common import JiraConnection
+from jiracrawler.cache import SharedMetadata, StoredMetadata
+from jiracrawler.config import jira_connection, read_profiles
+from jiracrawler.db import make_engine, upgrade_schema
+from jiracrawler.ids import IdPairs, IdSet, StoredIssues
+from jiracrawler.model import (Base, Version, Issue, IssueTombstone, Worklog, Status, SyncState,
+    CrawlCheckpoint)
+from jiracrawler.pool import WorklogFetcher, map_parallel
+from jiracrawler.rollup import refresh_rollups, rollups_missing
+from jiracrawler.stats import CrawlStats, InstrumentedService, write_json, write_prometheus
+from jiracrawler.store import MAX_PARAMETERS, BulkWriter, fingerprint
+from jiracrawler.throttle import Throttle
 
 
 logger = logging.getLogger(__name__)
 
+JQL_DATE_FORMAT = '%Y/%m/%d %H:%M'
+
+# Most subtasks stored by an incremental crawl whose parents are looked up
+# by their keys, parents of more are searched for like in full crawls
+HIERARCHY_KEYS = 200
+
+# Issue columns copied into rollups and snapshot partitions of its worklogs
+ROLLUP_COLUMNS = ('key', 'status_id', 'fix_version_id')
+
+# Versions are passed around as plain tuples, ORM objects can't be shared
+# between threads crawling versions concurrently
+VersionRef = namedtuple('VersionRef', ['id', 'name'])
+
+IssueType = namedtuple('IssueType', ['id', 'name', 'subtask'])
+
+# Progress of a crawl of one version, or of all of them for single pass crawls
+Checkpoint = namedtuple('Checkpoint', ['crawl', 'since', 'last_key', 'last_update', 'done'])
+
+
+class StaleMetadata(ValueError):
+    """Raised for issues referring to statuses or issue types the crawler doesn't know"""
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 
 class JiraCrawler(object):
 
-    def __init__(self, profile_name=None):
+    def __init__(self, profile_name=None, connect=None, jira_con=None, metadata=None,
+            refresh_metadata=False, throttle=None):
+        """Crawls JIRA project of the profile
+
+        connect creates JIRA connections, it defaults to SOAP or REST
+        connection of the profile and lets benchmarks substitute the service.
+        An already established connection may be given as jira_con.
+        metadata caches JIRA metadata shared by crawlers of several projects.
+        JIRA metadata cached in the database is dropped when refresh_metadata
+        is set.
+        throttle paces JIRA calls, by default the crawler makes its own from
+        the profile.
+        """
+        self.stats = CrawlStats()
+        self.metadata = metadata or SharedMetadata()
+        self.throttle = throttle
+
         logger.info("Establishing JIRA connection")
-        self.jira_con = JiraConnection(profile_name=profile_name)
+        self.connect = connect or partial(jira_connection, profile_name)
+        self.jira_con = self.open_connection(jira_con)
         #self.jira_con = JiraConnection(provider='SOAPpy')
         (self.auth, self.jira, self.project_name) = (
             self.jira_con.auth, self.jira_con.service, self.jira_con.project_name)
+        self.stats.project_name = self.project_name
+
+        self.engine = make_engine(self.jira_con.config, self.project_name, bulk_load=True)
+        self.stats.watch_engine(self.engine)
+        self.engine.connect()
+
+        Base.metadata.create_all(self.engine)
+        upgrade_schema(self.engine, Base.metadata)
+
+        self.Session = sessionmaker(bind=self.engine)
+        self.session = self.Session()
 
-        if 'db_name' in self.jira_con.config:
-            db_name = self.jira_con.config['db_name']
+        self.stored_metadata = StoredMetadata(self.session,
+            int(self.option('metadata_ttl', 86400)))
+        if refresh_metadata:
+            self.stored_metadata.clear()
+        self.load_issue_types()
+
+        self.writer = self.make_writer()
+
+        self.worklog_workers = int(self.option('worklog_workers', 1))
+        self.worklog_fetcher = None
+        self.recheck_worklogs = False
+        # Days whose worklogs the crawl changed and parents of stored subtasks
+        # told by JIRA, shared with forks
+        self.touched_dates = set()
+        self.parent_links = IdPairs()
+        # Ids of subtasks stored by the crawl, shared with forks
+        self.crawled_subtasks = IdSet()
+        # Names of crawled versions by their ids, for stats
+        self.version_names = {}
+
+    def load_issue_types(self, refresh=False):
+        def fetch():
+            project = self.jira.getProjectByKey(self.auth, self.project_name)
+            return [(t.id, t.name, t.subTask) for t in
+                list(self.jira.getSubTaskIssueTypesForProject(self.auth, project.id)) +
+                list(self.jira.getIssueTypesForProject(self.auth, project.id))]
+
+        with self.stats.phase('metadata'):
+            self.issue_types = dict((t[0], IssueType(*t)) for t in self.stored_metadata.get(
+                'issue_types:%s' % self.project_name, fetch, refresh))
+            self.session.commit()
+
+        logger.info("Received %s issue types", len(self.issue_types))
+
+    def make_writer(self):
+        return BulkWriter(self.session, [Issue.__table__, Worklog.__table__],
+            int(self.option('batch_size', 500)))
+
+    def open_connection(self, jira_con=None):
+        """Returns a new JIRA connection with calls throttled and counted in crawl stats"""
+        if jira_con:
+            # The connection may be shared with other crawlers
+            jira_con = copy.copy(jira_con)
         else:
-            db_name = '%s_jira' % self.jira_con.project_name.lower()
+            jira_con = self.connect()
+        if self.throttle is None:
+            self.throttle = Throttle.from_config(jira_con.config)
+        self.stats.throttle = self.throttle
+        jira_con.service = InstrumentedService(jira_con.service, self.stats, self.throttle)
+        return jira_con
+
+    def option(self, name, default=None):
+        if name in self.jira_con.config:
+            return self.jira_con.config[name]
+        return default
+
+    def flag(self, name):
+        return self.option(name, 'false').lower() in ('true', 'yes', 'on', '1')
+
+    def sync_since(self, sync_state, full):
+        """Returns the watermark to crawl from or None for a full crawl"""
+        if full or sync_state.updated_at is None:
+            return None
+
+        full_sync_interval = int(self.option('full_sync_interval', 7))
+        if full_sync_interval and (sync_state.full_sync_at is None or
+                datetime.now() - sync_state.full_sync_at > timedelta(days=full_sync_interval)):
+            logger.info("Last full sync is older than %s days, doing a full sync", full_sync_interval)
+            return None
+
+        return sync_state.updated_at
+
+    def recheck_due(self, sync_state, full):
+        """Tells if worklogs of unchanged issues have to be fetched again
+
+        JIRA doesn't always touch issues when their worklogs change, so they
+        are rechecked by the first full crawl after worklog_recheck_interval
+        days and by crawls forced with --full.
+        """
+        if full or sync_state.worklogs_checked_at is None:
+            return True
+        recheck_interval = int(self.option('worklog_recheck_interval', 30))
+        return bool(recheck_interval) and (datetime.now() - sync_state.worklogs_checked_at >
+            timedelta(days=recheck_interval))
 
-        if 'db_user' in self.jira_con.config:
-            db_user = self.jira_con.config['db_user']
+    def search_issues(self, jql, after=None):
+        """Yields all issues matching JQL query fetching them page by page
+
+        SOAP search has no offset argument so pages are chained by issue key:
+        each next page asks for issues with keys greater than the last one seen.
+        Issues up to key after are skipped.
+        """
+        page_size = int(self.option('page_size', 500))
+        last_key = after
+        while True:
+            if last_key:
+                query = '(%s) and issuekey > "%s"' % (jql, last_key)
+            else:
+                query = jql
+            page = self.jira.getIssuesFromJqlSearch(self.auth,
+                query + ' order by issuekey asc', self.jira_con.int_arg(page_size))
+            for issue in page:
+                yield issue
+            if len(page) < page_size:
+                break
+            last_key = page[-1].key
+
+    def updated_at(self, issue):
+        # MySQL DATETIME keeps no fractions of seconds, stored and fetched
+        # times have to compare equal
+        return self.jira_con.to_datetime(issue.updated).replace(microsecond=0)
+
+    def fetch_worklogs(self, issues):
+        """Returns lists of worklogs of the given issues in the same order
+
+        Worklogs embedded into issues by REST searches aren't fetched again.
+        """
+        embedded = [getattr(issue, 'worklogs', None) for issue in issues]
+        keys = [issue.key for (issue, worklogs) in zip(issues, embedded) if worklogs is None]
+        if not keys:
+            return embedded
+
+        if self.worklog_workers <= 1:
+            fetched = [self.jira.getWorklogs(self.auth, key) for key in keys]
         else:
-            db_user = 'root'
+            if not self.worklog_fetcher:
+                logger.info("Establishing %s JIRA connections to fetch worklogs",
+                    self.worklog_workers)
+                self.worklog_fetcher = WorklogFetcher([self.open_connection()
+                    for i in range(self.worklog_workers)])
+            fetched = self.worklog_fetcher.fetch(keys)
+        fetched = iter(fetched)
+        return [worklogs if worklogs is not None else fetched.next() for worklogs in embedded]
+
+    def close(self):
+        if self.worklog_fetcher:
+            self.worklog_fetcher.close()
+            self.worklog_fetcher = None
+
+    def store_issue(self, issue, version_id, stored_fingerprint=None, stored_columns=None):
+        """Stores issue unless its fingerprint is the stored one
+
+        stored_columns are ROLLUP_COLUMNS of the stored issue. Returns True
+        when the issue was written with other values in them, days of its
+        worklogs have to be rolled up again then.
+        """
+        if int(issue.status) not in self.statuses:
+            raise StaleMetadata("Issue %s has unknown status %s" % (issue.key, issue.status))
+        if issue.type not in self.issue_types:
+            raise StaleMetadata("Issue %s has unknown type %s" % (issue.key, issue.type))
+
+        row = {
+            'id': int(issue.id),
+            'key': issue.key,
+            'type': self.issue_types[issue.type].name,
+            'subtask': self.issue_types[issue.type].subtask,
+            'summary': issue.summary,
+            'assignee': issue.assignee,
+            'created_at': self.jira_con.to_datetime(issue.created),
+            'due_date': self.jira_con.to_datetime(issue.duedate) if issue.duedate else None,
+            'status_id': int(issue.status),
+            'fix_version_id': version_id,
+            'updated_at': self.updated_at(issue),
+        }
+        if row['subtask']:
+            self.crawled_subtasks.add(row['id'])
+        # REST searches tell parents of subtasks, they are linked after the crawl
+        parent_id = getattr(issue, 'parentId', None)
+        if parent_id:
+            self.parent_links.add(int(issue.id), int(parent_id))
+
+        row['fingerprint'] = fingerprint(row)
+        changed = row['fingerprint'] != stored_fingerprint
+        self.stats.count_rows('issue', self.version_names.get(version_id, '-'), changed)
+        if changed:
+            self.writer.add(Issue.__table__, row)
+        return changed and stored_columns != tuple(row[c] for c in ROLLUP_COLUMNS)
+
+    def store_worklog(self, worklog, issue, version_id, stored=None, issue_changed=True):
+        """Stores worklog unless its fingerprint is the stored one
+
+        stored is (fingerprint, creation time) of the stored worklog. Days of
+        worklogs are touched when the worklogs or issue_changed tell so.
+        """
+        # Weird thing: SUDS based client returns arrays instead of simple attrs
+        if isinstance(worklog.id, list):
+            print "Issue:", issue
+            print "Weird worklog:", worklog
+            sys.exit(1)
+
+        created_at = self.jira_con.to_datetime(worklog.created)
+        row = {
+            'id': int(worklog.id),
+            'created_at': created_at,
+            'author': worklog.author,
+            'time_spent': worklog.timeSpentInSeconds,
+            'issue_id': int(issue.id),
+        }
+        row['fingerprint'] = fingerprint(row)
+        changed = stored is None or row['fingerprint'] != stored[0]
+        self.stats.count_rows('worklog', self.version_names.get(version_id, '-'), changed)
+        if changed:
+            self.writer.add(Worklog.__table__, row)
+            if stored:
+                # Work moved away from the day the worklog was created before
+                self.touched_dates.add(stored[1].date())
+        if changed or issue_changed:
+            self.touched_dates.add(created_at.date())
+
+    def stored_worklogs(self, issue_ids):
+        """Returns (fingerprint, creation time) of stored worklogs of the issues by their ids"""
+        worklog = Worklog.__table__
+        stored = {}
+        for batch in batches(issue_ids, MAX_PARAMETERS):
+            for (id, stored_fingerprint, created_at) in self.session.execute(
+                    select([worklog.c.id, worklog.c.fingerprint, worklog.c.created_at])\
+                    .where(worklog.c.issue_id.in_(batch))):
+                stored[id] = (stored_fingerprint, created_at)
+        return stored
+
+    def stored_issue_columns(self, issue_ids):
+        """Returns ROLLUP_COLUMNS of stored issues by their ids"""
+        issue = Issue.__table__
+        stored = {}
+        for batch in batches(issue_ids, MAX_PARAMETERS):
+            for row in self.session.execute(select([issue.c.id] +
+                    [issue.c[c] for c in ROLLUP_COLUMNS]).where(issue.c.id.in_(batch))):
+                stored[row[0]] = tuple(row[1:])
+        return stored
 
-        if 'db_pass' in self.jira_con.config:
-            db_pass = self.jira_con.config['db_pass']
+    def find_parent_links(self, version_model, updated_filter):
+        """Returns (subtask id, parent id) links of subtasks of the version's tasks
+
+        Only links which differ from the stored ones are returned. Subtasks
+        are searched for many parents at once, stored parents of the found
+        subtasks are confirmed with one more search and parents of the rest
+        are found by bisecting the list of parents.
+        """
+        links = IdPairs()
+        for batch in batches(self.version_tasks(version_model),
+                int(self.option('hierarchy_batch', 50))):
+            parent_ids = dict((key, id) for (id, key) in batch)
+            subtask_keys = [subtask.key for subtask in self.search_issues('parent in (%s)%s' % (
+                ', '.join('"%s"' % key for key in parent_ids), updated_filter))]
+            if not subtask_keys:
+                continue
+
+            subtasks = {}
+            for keys in batches(subtask_keys, MAX_PARAMETERS):
+                subtasks.update((key, (id, parent_id)) for (id, key, parent_id) in
+                    self.session.query(Issue.id, Issue.key, Issue.parent_id)\
+                        .filter(Issue.key.in_(keys)))
+            for key in subtask_keys:
+                if key not in subtasks:
+                    logger.warn("Can't find subtask %s", key)
+
+            parent_keys = dict((id, key) for (key, id) in parent_ids.items())
+            confirmed = self.confirm_parents(dict((key, parent_keys[parent_id])
+                for (key, (id, parent_id)) in subtasks.items() if parent_id in parent_keys))
+            links.extend(self.moved_links(parent_ids, subtasks,
+                [key for key in subtask_keys if key in subtasks and key not in confirmed]))
+
+        return links
+
+    def crawled_parent_links(self, versions):
+        """Returns links of subtasks stored by the crawl whose parents changed
+
+        Stored parents of the subtasks are confirmed with one search, the
+        other subtasks are searched for among tasks of the versions until all
+        of them are found.
+        """
+        issue = Issue.__table__
+        parent = issue.alias('parent')
+        subtasks = {}
+        guesses = {}
+        for (id, key, parent_id, parent_key) in self.session.execute(select([issue.c.id,
+                issue.c.key, issue.c.parent_id, parent.c.key],
+                issue.c.id.in_(list(self.crawled_subtasks)),
+                from_obj=[issue.outerjoin(parent, parent.c.id == issue.c.parent_id)])):
+            subtasks[key] = (id, parent_id)
+            if parent_key:
+                guesses[key] = parent_key
+        remaining = set(subtasks) - self.confirm_parents(guesses)
+
+        links = IdPairs()
+        tasks = (task for version in versions for task in self.version_tasks(version))
+        for batch in batches(tasks, int(self.option('hierarchy_batch', 50))):
+            if not remaining:
+                break
+            parent_ids = dict((key, id) for (id, key) in batch)
+            found = [subtask.key for subtask in self.search_issues(
+                'parent in (%s) and issuekey in (%s)' % (
+                    ', '.join('"%s"' % key for key in parent_ids),
+                    ', '.join('"%s"' % key for key in sorted(remaining))))]
+            links.extend(self.moved_links(parent_ids, subtasks, found))
+            remaining.difference_update(found)
+        if remaining:
+            logger.info("Parents of %s subtasks aren't stored", len(remaining))
+        return links
+
+    def version_tasks(self, version):
+        """Returns (id, key) of stored issues of the version which aren't subtasks"""
+        if version:
+            version_filter = Issue.fix_version_id == version.id
         else:
-            db_pass = ''
+            version_filter = Issue.fix_version_id == None
+        return self.session.query(Issue.id, Issue.key)\
+            .filter(and_(Issue.subtask == False, version_filter)).yield_per(1000)
 
-        logger.info("Using database %s to store data", db_name)
-        self.engine = create_engine('mysql://%s:%s@localhost/%s' % (db_user, db_pass, db_name), echo=False)
-        self.engine.connect()
+    def confirm_parents(self, guesses):
+        """Returns keys of subtasks whose parents are the guessed ones
 
-        Base.metadata.create_all(self.engine)
+        guesses maps keys of subtasks to keys of their supposed parents, they
+        are all checked with one search.
+        """
+        if not guesses:
+            return set()
+        subtasks = {}
+        for (key, parent_key) in guesses.items():
+            subtasks.setdefault(parent_key, []).append(key)
+        return set(subtask.key for subtask in self.search_issues(' or '.join(
+            '(parent = "%s" and issuekey in (%s))' % (parent_key,
+                ', '.join('"%s"' % key for key in sorted(keys)))
+            for (parent_key, keys) in sorted(subtasks.items()))))
 
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+    def moved_links(self, parent_ids, subtasks, keys):
+        """Returns links of subtasks of the keys whose parents differ from the stored ones
 
-        self.project = self.jira.getProjectByKey(self.auth, self.project_name)
+        parent_ids maps keys of parents to their ids, subtasks maps keys of
+        subtasks to their ids and stored parent ids. Subtasks of the keys
+        have to belong to one of the parents.
+        """
+        links = IdPairs()
+        if keys:
+            for (key, parent_key) in self.resolve_parents(sorted(parent_ids), keys).items():
+                (subtask_id, stored_parent_id) = subtasks[key]
+                if parent_ids[parent_key] != stored_parent_id:
+                    links.add(subtask_id, parent_ids[parent_key])
+        return links
 
-        self.issue_types = {}
-        for t in self.jira.getSubTaskIssueTypesForProject(self.auth, self.project.id):
-            self.issue_types[t.id] = t
-        for t in self.jira.getIssueTypesForProject(self.auth, self.project.id):
-            self.issue_types[t.id] = t
+    def unlinked(self, links):
+        """Returns (subtask id, parent id) links between stored issues which aren't stored yet"""
+        issue = Issue.__table__
+        result = IdPairs()
+        # Every link takes two parameters
+        for batch in batches(links, MAX_PARAMETERS / 2):
+            ids = set(id for link in batch for id in link)
+            parents = dict((id, parent_id) for (id, parent_id) in self.session.execute(
+                select([issue.c.id, issue.c.parent_id]).where(issue.c.id.in_(list(ids)))))
+            result.extend((subtask_id, parent_id) for (subtask_id, parent_id) in batch
+                if subtask_id in parents and parent_id in parents and
+                    parents[subtask_id] != parent_id)
+        return result
 
-        logger.info("Received %s issue types", len(self.issue_types))
+    def link_subtasks(self, links):
+        """Sets parents of subtasks from (subtask id, parent id) links"""
+        for batch in batches(links, MAX_PARAMETERS):
+            self.session.execute(Issue.__table__.update()\
+                .where(Issue.id == bindparam('subtask_id'))\
+                .values(parent_id=bindparam('parent_id')),
+                [{'subtask_id': subtask_id, 'parent_id': parent_id}
+                    for (subtask_id, parent_id) in batch])
+        self.touch_worklogs(subtask_id for (subtask_id, parent_id) in links)
 
-    def store_issue(self, issue, issue_model, version_model):
-        issue_model.key = issue.key
-        issue_model.type = self.issue_types[issue.type].name
-        issue_model.subtask = self.issue_types[issue.type].subTask
-        issue_model.summary = issue.summary
-        issue_model.assignee = issue.assignee
-        issue_model.created_at = self.jira_con.to_datetime(issue.created)
-        issue_model.status = self.statuses[int(issue.status)]
-        issue_model.fix_version = version_model
+    def resolve_parents(self, parent_keys, subtask_keys):
+        """Returns parent key for each of subtasks known to belong to one of the parents"""
+        if len(parent_keys) == 1:
+            return dict((key, parent_keys[0]) for key in subtask_keys)
 
-        if issue.duedate:
-            issue_model.due_date = self.jira_con.to_datetime(issue.duedate)
+        half = len(parent_keys) / 2
+        found = set(subtask.key for subtask in self.search_issues('parent in (%s) and issuekey in (%s)' % (
+            ', '.join('"%s"' % key for key in parent_keys[:half]),
+            ', '.join('"%s"' % key for key in subtask_keys))))
 
-        try:
-            return self.session.merge(issue_model)
-        except:
-            logger.error("Can't merge issue %s" % issue.key)
-            raise
-
-    def update_issue(self, version_model, issue):
-        issue_model = self.session.query(Issue).get(int(issue.id))
-        return self.store_issue(issue, issue_model, version_model)
-
-    def create_issue(self, version_model, issue):
-        issue_model = Issue(id=int(issue.id))
-        return self.store_issue(issue, issue_model, version_model)
-
-    def update_statuses(self):
-        self.statuses = {}
-        for status in self.jira.getStatuses(self.auth):
-            s = Status(id=int(status.id), name=status.name)
-            s = self.session.merge(s)
-            self.statuses[s.id] = s
-
-    def update_issues_and_worklogs(self, versions = None):
-        active_versions = []
+        # Subtasks not found under the first half belong to the second one
+        result = {}
+        if found:
+            result.update(self.resolve_parents(parent_keys[:half], list(found)))
+        rest = [key for key in subtask_keys if key not in found]
+        if rest:
+            result.update(self.resolve_parents(parent_keys[half:], rest))
+        return result
+
+    def update_statuses(self, refresh=False):
+        def fetch():
+            return [(status.id, status.name) for status in self.jira.getStatuses(self.auth)]
+
+        key = ('statuses', self.option('uri'))
+        if refresh:
+            self.metadata.invalidate(key)
+        with self.stats.phase('statuses'):
+            self.statuses = {}
+            for (id, name) in self.metadata.get(key,
+                    lambda: self.stored_metadata.get('statuses', fetch, refresh)):
+                s = Status(id=int(id), name=name)
+                s = self.session.merge(s)
+                self.statuses[s.id] = s
 
-        existing_issues = set(int(e[0]) for e in self.session.query(Issue.id).all())
+    def crawl(self, versions=None, full=False, single_pass=False):
+        """Updates statuses, then issues and worklogs of the versions
 
-        for version in self.jira.getVersions(self.auth, self.project_name) + [None]:
-            if version and version.releaseDate is not None:
+        Cached metadata is refreshed and the crawl repeated once when issues
+        refer to statuses or issue types missing from the cache.
+        """
+        self.update_statuses()
+        try:
+            return self.update_issues_and_worklogs(versions, full, single_pass)
+        except StaleMetadata, e:
+            logger.info("%s, refreshing JIRA metadata", e)
+            self.session.rollback()
+            self.load_issue_types(refresh=True)
+            self.update_statuses(refresh=True)
+            return self.update_issues_and_worklogs(versions, full, single_pass)
+
+    def update_versions(self, versions=None):
+        """Stores project versions, returns references to the versions to crawl"""
+        active_versions = []
+        for version in self.jira.getVersions(self.auth, self.project_name):
+            if version.releaseDate is not None:
                 release_date = self.jira_con.to_datetime(version.releaseDate)
             else:
                 release_date = None
 
-            if version and versions and not version.name in versions:
+            if versions and not version.name in versions:
                 continue
 
-            if version:
-                version_model = self.session.query(Version).get(version.id)
-                if version_model:
-                    if version_model.archived and not versions:
-                        logger.info("Skipping archived version %s", version.name)
-                        continue
-                    if version.archived:
-                        logger.info("Archiving version %s", version.name)
-                        version_model.archived = True
-                else:
-                    version_model = Version(id=int(version.id), name=version.name,
-                        release_date=release_date, archived=version.archived)
-                    self.session.add(version_model)
-                    self.session.flush()
-
-                active_versions.append(version_model)
+            version_model = self.session.query(Version).get(version.id)
+            if version_model:
+                if version_model.archived and not versions:
+                    logger.info("Skipping archived version %s", version.name)
+                    continue
+                if version.archived:
+                    logger.info("Archiving version %s", version.name)
+                    version_model.archived = True
             else:
-                version_model = None
+                version_model = Version(id=int(version.id), name=version.name,
+                    release_date=release_date, archived=version.archived)
+                self.session.add(version_model)
+                self.session.flush()
 
-            logger.info("Cloning issues for version %s", version.name if version else '-')
+            active_versions.append(VersionRef(version_model.id, version_model.name))
+        return active_versions
+
+    def version_issues(self, version):
+        """Returns update times and fingerprints of issues stored for the version"""
+        if version:
+            version_filter = Issue.fix_version_id == version.id
+        else:
+            version_filter = Issue.fix_version_id == None
+        return StoredIssues((int(id), updated_at, stored_fingerprint)
+            for (id, updated_at, stored_fingerprint) in
+                self.session.query(Issue.id, Issue.updated_at, Issue.fingerprint)\
+                    .filter(version_filter).order_by(Issue.id).yield_per(1000))
 
-            if version:
-                issues = self.jira.getIssuesFromJqlSearch(self.auth,
-                    "project = %s and fixVersion = '%s'" % (self.project_name, version.name),
-                    self.jira_con.int_arg(1000))
-                version_issues = set(int(e[0]) for e in self.session.query(Issue.id)\
-                            .filter(Issue.fix_version == version_model))
+    def newest_version(self, issue):
+        """Returns id of the latest fix version of JIRA issue, issues are stored there"""
+        if not issue.fixVersions:
+            return None
+        return max(int(v.id) for v in issue.fixVersions)
+
+    def store_issues(self, issues, seen, stored=None, progress=None):
+        """Stores (issue, version id) pairs along with the issues' worklogs
+
+        Ids of found issues are added to seen IdSet.
+        stored maps version ids to StoredIssues of the version, issues stored
+        in the same version with the same update time are unchanged and
+        skipped unless worklogs are rechecked.
+        Every checkpoint_size issues everything is written and progress is
+        called with the last issue key and update time.
+        Returns the latest update time of the issues.
+        """
+        stored = stored or {}
+        checkpoint_size = int(self.option('checkpoint_size', 1000))
+        last_update = None
+        changed = []
+        for (count, (issue, version_id)) in enumerate(issues, 1):
+            updated_at = self.updated_at(issue)
+            if last_update is None or updated_at > last_update:
+                last_update = updated_at
+
+            seen.add(int(issue.id))
+            version_issues = stored.get(version_id)
+            if version_issues is None or updated_at != version_issues.get(int(issue.id)) or \
+                    self.recheck_worklogs:
+                changed.append((issue, version_id, version_issues.fingerprint(int(issue.id))
+                    if version_issues is not None else None))
             else:
-                issues = self.jira.getIssuesFromJqlSearch(self.auth,
-                    "project = %s and fixVersion is EMPTY" % self.project_name,
-                    self.jira_con.int_arg(1000))
-                version_issues = set(int(e[0]) for e in self.session.query(Issue.id)\
-                            .filter(Issue.fix_version == None))
-
-            for issue in issues:
-                if version:
-                    issue_versions = sorted(issue.fixVersions, lambda v1, v2: \
-                        int(v2.id) - int(v1.id))
-                    if issue_versions[0].name != version.name:
-                        continue
-
-                existing_issue = int(issue.id) in existing_issues
-                if existing_issue:
-                    if int(issue.id) in version_issues:
-                        version_issues.remove(int(issue.id))
-                    issue_model = self.update_issue(version_model, issue)
-                else:
-                    issue_model = self.create_issue(version_model, issue)
-
-                for worklog in self.jira.getWorklogs(self.auth, issue.key):
-                    if existing_issue:
-                        # Weird thing: SUDS based client returns arrays instead of simple attrs
-                        if isinstance(worklog.id, list):
-                            print "Issue:", issue
-                            print "Weird worklog:", worklog
-                            sys.exit(1)
-                        worklog_model = self.session.query(Worklog).get(int(worklog.id))
-                    else:
-                        worklog_model = None
-
-                    if not worklog_model:
-                        worklog_model = Worklog(id=int(worklog.id))
-
-                    worklog_model.created_at=self.jira_con.to_datetime(worklog.created)
-                    worklog_model.author=worklog.author
-                    worklog_model.time_spent=worklog.timeSpentInSeconds
-                    worklog_model.issue=issue_model
-
-                    self.session.merge(worklog_model)
-
-            for issue_id in version_issues:
-                issue = self.session.query(Issue).get(issue_id)
-                logger.info("Removing issue %s deleted from version %s", issue.key,
-                    version.name if version else 'Unscheduled')
-                self.session.delete(issue)
-                if issue_id in existing_issues:
-                    existing_issues.remove(issue_id)
+                self.stats.count_rows('issue', self.version_names.get(version_id, '-'), False)
+            if len(changed) >= max(self.worklog_workers * 8, 1):
+                self.store_changed(changed)
+                changed = []
+
+            if progress and checkpoint_size and count % checkpoint_size == 0:
+                if changed:
+                    self.store_changed(changed)
+                    changed = []
+                self.writer.flush()
+                progress(issue.key, last_update)
+        if changed:
+            self.store_changed(changed)
+
+        self.writer.flush()
+        return last_update
+
+    def store_changed(self, issues):
+        """Stores (issue, version id, stored fingerprint) tuples with the issues' worklogs
+
+        Only issues and worklogs whose fingerprints differ from the stored
+        ones are written.
+        """
+        stored = self.stored_worklogs([int(issue.id) for (issue, version_id, f) in issues])
+        # Issues without a stored fingerprint are new or moved between versions
+        columns = self.stored_issue_columns([int(issue.id) for (issue, version_id, f) in issues
+            if f is not None])
+        for ((issue, version_id, stored_fingerprint), worklogs) in zip(issues,
+                self.fetch_worklogs([issue for (issue, version_id, f) in issues])):
+            issue_changed = self.store_issue(issue, version_id, stored_fingerprint,
+                columns.get(int(issue.id)))
+            for worklog in worklogs:
+                self.store_worklog(worklog, issue, version_id, stored.get(int(worklog.id)),
+                    issue_changed)
+
+    def touch_worklogs(self, issue_ids):
+        """Marks days of stored worklogs of the issues as touched"""
+        worklog = Worklog.__table__
+        for batch in batches(sorted(issue_ids), MAX_PARAMETERS):
+            self.touched_dates.update(created_at.date() for (created_at,) in self.session.execute(
+                select([worklog.c.created_at]).where(worklog.c.issue_id.in_(batch))))
+
+    def remove_issues(self, issue_ids):
+        """Removes issues deleted from JIRA with their worklogs, returns number of removed issues
+
+        Subtasks of removed issues are unlinked. With tombstones enabled in
+        the profile removed issues are recorded in issuetombstone table.
+        """
+        issue = Issue.__table__
+        worklog = Worklog.__table__
+        tombstones = BulkWriter(self.session, [IssueTombstone.__table__],
+            int(self.option('batch_size', 500)))
+        deleted_at = datetime.now()
+
+        # Unlinking subtasks takes one more parameter than the ids
+        for batch in batches(sorted(issue_ids), MAX_PARAMETERS - 1):
+            rows = self.session.execute(select([issue.c.id, issue.c.key, issue.c.fix_version_id])\
+                .where(issue.c.id.in_(batch))).fetchall()
+            logger.info("Removing %s issues deleted from JIRA: %s", len(rows),
+                ', '.join(row.key for row in rows))
+            if self.flag('tombstones'):
+                for row in rows:
+                    tombstones.add(IssueTombstone.__table__, {'id': row.id, 'key': row.key,
+                        'fix_version_id': row.fix_version_id, 'deleted_at': deleted_at})
+            # Work on unlinked subtasks moves to the subtasks themselves
+            self.touch_worklogs(batch + [id for (id,) in self.session.execute(
+                select([issue.c.id]).where(issue.c.parent_id.in_(batch)))])
+
+            self.session.execute(issue.update().where(issue.c.parent_id.in_(batch))\
+                .values(parent_id=None))
+            self.session.execute(worklog.delete().where(worklog.c.issue_id.in_(batch)))
+            self.session.execute(issue.delete().where(issue.c.id.in_(batch)))
 
+        tombstones.flush()
+        return len(issue_ids)
+
+    def crawl_issues(self, jql, versions, checkpoint=None):
+        """Stores issues found by JQL query into the versions they belong to
+
+        A crawl resumed from a checkpoint skips issues up to its last key.
+        Progress is committed along with the checkpoint. Returns the latest
+        update time of found issues, set of their ids and ids of issues
+        stored for each of the versions which weren't found.
+        """
+        version_issues = dict((version.id if version else None, self.version_issues(version))
+            for version in versions)
+
+        def progress(last_key, last_update, done=False):
+            if checkpoint.last_update and (not last_update or checkpoint.last_update > last_update):
+                last_update = checkpoint.last_update
+            self.session.merge(CrawlCheckpoint(project=self.project_name, crawl=checkpoint.crawl,
+                since=checkpoint.since, last_key=last_key, last_update=last_update, done=done))
             self.session.commit()
+            return last_update
+
+        # Issues are stored only in their latest fix version
+        seen = IdSet()
+        after = checkpoint.last_key if checkpoint else None
+        if after:
+            logger.info("Resuming crawl after issue %s", after)
+        routed = ((issue, self.newest_version(issue)) for issue in self.search_issues(jql, after))
+        last_update = self.store_issues(((issue, version_id) for (issue, version_id) in routed
+            if version_id in version_issues), seen, version_issues, checkpoint and progress)
+        if checkpoint:
+            last_update = progress(None, last_update, done=True)
+        self.session.commit()
+
+        missing = dict((version, [id for id in version_issues[version.id if version else None]
+            if id not in seen]) for version in versions)
+        return (last_update, seen, missing)
+
+    def load_checkpoints(self, since):
+        """Returns checkpoints of an interrupted crawl from the same watermark by crawl names"""
+        query = self.session.query(CrawlCheckpoint)\
+            .filter(CrawlCheckpoint.project == self.project_name)
+        rows = query.all()
+        if any(row.since != since for row in rows):
+            logger.info("Discarding checkpoints of an interrupted crawl since %s", rows[0].since)
+            query.delete()
+            return {}
+        return dict((row.crawl, Checkpoint(row.crawl, row.since, row.last_key, row.last_update,
+            row.done)) for row in rows)
+
+    def fork(self):
+        """Returns crawler sharing configuration and stats with this one
 
-        for version in (active_versions if versions else active_versions + [None]):
-            logger.info("Updating issues hierarchy for version %s", version.name if version else '-')
+        The fork has its own JIRA connection and database session, so it can
+        crawl in another thread.
+        """
+        worker = copy.copy(self)
+        worker.jira_con = self.open_connection()
+        (worker.auth, worker.jira) = (worker.jira_con.auth, worker.jira_con.service)
+        worker.session = self.Session()
+        worker.writer = worker.make_writer()
+        worker.worklog_fetcher = None
+        return worker
 
-            if version:
-                issues = self.session.query(Issue)\
-                    .filter(and_(Issue.subtask == False, Issue.fix_version == version))
+    def crawl_versions(self, crawls):
+        """Runs crawl_issues for (version name, jql, versions, checkpoint) tuples, returns their results
+
+        Crawls run concurrently in version_workers forks of the crawler,
+        except on SQLite which lets only one of them write.
+        """
+        def crawl(crawler, (version_name, jql, versions, checkpoint)):
+            if version_name:
+                logger.info("Cloning issues for version %s", version_name)
             else:
-                issues = self.session.query(Issue)\
-                    .filter(and_(Issue.subtask == False, Issue.fix_version == None))
+                logger.info("Cloning issues of %s versions", len(versions))
+            with self.stats.phase('issues', version_name):
+                return crawler.crawl_issues(jql, versions, checkpoint)
+
+        version_workers = min(int(self.option('version_workers', 1)), len(crawls))
+        if version_workers > 1 and self.engine.dialect.name == 'sqlite':
+            # A worker holds the write lock from its first flush to its next
+            # checkpoint, the others would time out waiting for it
+            logger.warn("SQLite database can't be written by %s version workers, "
+                "crawling versions one at a time", version_workers)
+            version_workers = 1
+        if version_workers <= 1:
+            return [crawl(self, c) for c in crawls]
+
+        logger.info("Crawling %s versions in %s workers", len(crawls), version_workers)
+        workers = [self.fork() for i in range(version_workers)]
+        try:
+            return map_parallel(crawl, crawls, workers)
+        finally:
+            for worker in workers:
+                worker.close()
+                worker.session.close()
+
+    def update_issues_and_worklogs(self, versions = None, full = False, single_pass = False):
+        """Crawls issues of the versions, all versions by default
+
+        Returns True when anything has changed since the previous crawl.
+        """
+        sync_state = self.session.query(SyncState).get(self.project_name)
+        if not sync_state:
+            sync_state = SyncState(project=self.project_name)
+            self.session.add(sync_state)
+
+        since = self.sync_since(sync_state, full)
+        if since:
+            logger.info("Fetching issues updated since %s", since)
+            updated_filter = " and updated >= '%s'" % since.strftime(JQL_DATE_FORMAT)
+        else:
+            updated_filter = ""
+        last_update = previous_update = sync_state.updated_at
 
-            for issue in issues:
+        self.touched_dates = set()
+        self.parent_links = IdPairs()
+        self.crawled_subtasks = IdSet()
+        self.recheck_worklogs = not since and self.recheck_due(sync_state, full)
+        if self.recheck_worklogs:
+            logger.info("Fetching worklogs of all issues, including unchanged ones")
 
-                    subtasks = self.jira.getIssuesFromJqlSearch(self.auth,
-                        'parent = "%s"' % issue.key, self.jira_con.int_arg(100))
-                    for subtask in subtasks:
-                        try:
-                            subtask_model = self.session.query(Issue).filter(Issue.key == subtask.key).one()
-                            subtask_model.parent = issue
-                        except NoResultFound:
-                            logger.warn("Can't find subtask %s of task %s", subtask.key, issue.key)
+        checkpoints = self.load_checkpoints(since)
+        if checkpoints:
+            logger.info("Resuming interrupted crawl, %s of its versions are done",
+                len([c for c in checkpoints.values() if c.done]))
 
+        with self.stats.phase('versions'):
+            active_versions = self.update_versions(versions)
+        self.version_names = dict((version.id, version.name) for version in active_versions)
+        # Versions have to be visible to the sessions of version workers
         self.session.commit()
 
+        if single_pass:
+            if versions and active_versions:
+                version_filter = " and (fixVersion in (%s) or fixVersion is EMPTY)" % \
+                    ', '.join("'%s'" % version.name for version in active_versions)
+            elif versions:
+                version_filter = " and fixVersion is EMPTY"
+            else:
+                version_filter = ""
+            crawls = [(None, "project = %s%s%s" % (self.project_name, version_filter, updated_filter),
+                active_versions + [None])]
+        else:
+            crawls = [(version.name, "project = %s and fixVersion = '%s'%s" % (
+                    self.project_name, version.name, updated_filter), [version])
+                for version in active_versions]
+            crawls.append(('-', "project = %s and fixVersion is EMPTY%s" % (
+                self.project_name, updated_filter), [None]))
+
+        pending = []
+        for (version_name, jql, crawl_versions) in crawls:
+            name = version_name or '*'
+            checkpoint = checkpoints.get(name, Checkpoint(name, since, None, None, False))
+            if not checkpoint.done:
+                pending.append((version_name, jql, crawl_versions, checkpoint))
+            elif checkpoint.last_update and (last_update is None or
+                    checkpoint.last_update > last_update):
+                last_update = checkpoint.last_update
+
+        # Issues moved between versions are seen in one and missing in another
+        # one, so removals are decided after all versions are crawled
+        seen = IdSet()
+        missing = {}
+        for (issues_update, crawl_seen, crawl_missing) in self.crawl_versions(pending):
+            if issues_update and (last_update is None or issues_update > last_update):
+                last_update = issues_update
+            seen.update(crawl_seen)
+            missing.update(crawl_missing)
+
+        # Issues missing from an incremental result are just unchanged,
+        # deletions are picked up by the next full sync
+        removed = 0
+        if not since and checkpoints:
+            logger.info("Issues seen before the crawl was interrupted are unknown, "
+                "removals are left to the next full crawl")
+        elif not since:
+            with self.stats.phase('removal'):
+                removed = self.remove_issues(set(id for issue_ids in missing.values()
+                    for id in issue_ids if id not in seen))
+                self.session.commit()
+
+        links = IdPairs()
+        hierarchy_versions = active_versions if versions else active_versions + [None]
+        if self.option('api', 'soap').lower() == 'rest' and not checkpoints:
+            # Subtasks stored before an interruption are only found by searches
+            with self.stats.phase('hierarchy'):
+                links = self.unlinked(self.parent_links)
+        elif since and not checkpoints and len(self.crawled_subtasks) <= HIERARCHY_KEYS:
+            # Subtasks moved to other parents are updated, so they are among
+            # the crawled ones
+            if self.crawled_subtasks:
+                logger.info("Updating parents of %s subtasks", len(self.crawled_subtasks))
+                with self.stats.phase('hierarchy'):
+                    links = self.crawled_parent_links(hierarchy_versions)
+        else:
+            for version in hierarchy_versions:
+                logger.info("Updating issues hierarchy for version %s",
+                    version.name if version else '-')
+                with self.stats.phase('hierarchy', version.name if version else '-'):
+                    links.extend(self.find_parent_links(version, updated_filter))
+
+        if links:
+            logger.info("Linking %s subtasks to their parents", len(links))
+            with self.stats.phase('links'):
+                self.link_subtasks(links)
+
+        with self.stats.phase('rollups'):
+            # Days touched before an interruption are unknown
+            if self.recheck_worklogs or checkpoints or rollups_missing(self.session):
+                logger.info("Rebuilding rollups")
+                refresh_rollups(self.session)
+            elif self.touched_dates:
+                logger.info("Updating rollups of %s days", len(self.touched_dates))
+                refresh_rollups(self.session, self.touched_dates)
+
+        # The watermark is only valid if every version has been crawled
+        if not versions:
+            sync_state.updated_at = last_update
+            if not since and not checkpoints:
+                sync_state.full_sync_at = datetime.now()
+            if self.recheck_worklogs:
+                sync_state.worklogs_checked_at = datetime.now()
+
+        self.session.query(CrawlCheckpoint)\
+            .filter(CrawlCheckpoint.project == self.project_name).delete()
+        self.session.commit()
+
+        changed = bool(removed or links or last_update != previous_update)
+        if self.option('snapshot_dir'):
+            with self.stats.phase('snapshot'):
+                self.update_snapshot(changed, bool(self.recheck_worklogs or checkpoints))
+        return changed
+
+    def update_snapshot(self, changed, rebuild=False):
+        """Rewrites columnar snapshot of the database if the crawl changed it"""
+        from jiracrawler.snapshot import snapshot_complete, write_snapshot
+        path = self.option('snapshot_dir')
+        if not (changed or rebuild) and snapshot_complete(path):
+            return
+        logger.info("Writing snapshot into %s", path)
+        partitions = write_snapshot(self.session, path, self.project_name,
+            self.option('snapshot_format', 'arrow'), None if rebuild else self.touched_dates)
+        logger.info("Rewritten %s worklog partitions of the snapshot", partitions)
+
+
+def write_stats(stats, options):
+    for crawl_stats in stats:
+        logger.info("Crawled %s in %.1f seconds with %s JIRA calls and %s SQL statements",
+            crawl_stats.project_name, crawl_stats.finished - crawl_stats.started,
+            crawl_stats.rpc_calls(), crawl_stats.sql_statements)
+    if options.stats_json:
+        write_json(stats, options.stats_json)
+    if options.prometheus_textfile:
+        write_prometheus(stats, options.prometheus_textfile)
+
+
+def default_lockfile(profile_names):
+    return os.path.expanduser('~/.jiracrawler-%s.pid' % '-'.join(
+        name or 'default' for name in profile_names))
+
+
 def main():
-    logging.root.addHandler(logging.StreamHandler())
-    logging.root.setLevel(logging.DEBUG)
-    logging.getLogger('suds').setLevel(logging.INFO)
+    if sys.argv[1:2] == ['report']:
+        from jiracrawler.report import main as report
+        logging.root.addHandler(logging.StreamHandler())
+        report(sys.argv[2:])
+        return
+
+    parser = OptionParser(usage="%prog [options] [profile [version ...]]")
+    parser.add_option("--full", action="store_true", default=False,
+        help="refetch all issues instead of the ones updated since the last crawl")
+    parser.add_option("--single-pass", action="store_true", default=False,
+        help="fetch all issues of the project with one search instead of one per version")
+    parser.add_option("--refresh-metadata", action="store_true", default=False,
+        help="fetch issue types and statuses from JIRA instead of the cache")
+    parser.add_option("--profiles", metavar="PROFILE,...",
+        help="crawl projects of several profiles in one process")
+    parser.add_option("--project-workers", type="int", default=1, metavar="N",
+        help="number of projects crawled at once with --profiles")
+    parser.add_option("--stats-json", metavar="FILE",
+        help="write timings and JIRA/SQL call counters of the crawl as JSON")
+    parser.add_option("--prometheus-textfile", metavar="FILE",
+        help="write crawl metrics for Prometheus node exporter textfile collector")
+    parser.add_option("--daemon", action="store_true", default=False,
+        help="keep running and poll JIRA for updates")
+    parser.add_option("--foreground", action="store_true", default=False,
+        help="don't detach the daemon from terminal")
+    parser.add_option("--interval", type="int", default=300, metavar="SECONDS",
+        help="pause between polls of the daemon")
+    parser.add_option("--max-interval", type="int", default=3600, metavar="SECONDS",
+        help="longest pause between polls which found no changes")
+    parser.add_option("--jitter", type="float", default=0.1, metavar="FRACTION",
+        help="random variation of pauses between polls")
+    parser.add_option("--lockfile", metavar="FILE",
+        help="PID file preventing overlapping crawls, ~/.jiracrawler-PROFILE.pid by default")
+    parser.add_option("--log-file", metavar="FILE",
+        help="write log to the file instead of stderr")
+    (options, args) = parser.parse_args()
 
     profile_name = None
     versions = None
-    if len(sys.argv) > 1:
-        profile_name = sys.argv[1]
-    if len(sys.argv) > 2:
-        versions = sys.argv[2:]
-    crawler = JiraCrawler(profile_name)
-    crawler.update_statuses()
-    crawler.update_issues_and_worklogs(versions)
+    if len(args) > 0:
+        profile_name = args[0]
+    if len(args) > 1:
+        versions = args[1:]
+    if options.profiles and args:
+        parser.error("--profiles can't be used with profile and versions arguments")
+    if options.daemon and versions:
+        parser.error("--daemon crawls whole projects, versions can't be given")
+    if options.daemon and options.full:
+        parser.error("--full can't be used with --daemon, set full_sync_interval instead")
+    if options.daemon and not options.foreground and not options.log_file:
+        parser.error("--daemon needs --log-file unless it runs in --foreground")
+    profiles = None
+    if options.profiles:
+        profiles = read_profiles()
+        unknown = [name for name in options.profiles.split(',') if name not in profiles]
+        if unknown:
+            parser.error("Unknown profiles: %s" % ', '.join(unknown))
+
+    if options.log_file:
+        handler = WatchedFileHandler(options.log_file)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+    else:
+        handler = logging.StreamHandler()
+    logging.root.addHandler(handler)
+    logging.root.setLevel(logging.DEBUG)
+    logging.getLogger('suds').setLevel(logging.INFO)
+
+    if options.profiles:
+        profile_names = options.profiles.split(',')
+    else:
+        profile_names = [profile_name]
+    lock_path = options.lockfile or default_lockfile(profile_names)
+
+    def crawl(crawler):
+        return crawler.crawl(versions, full=options.full,
+            single_pass=options.single_pass or crawler.flag('single_pass'))
+
+    from jiracrawler.scheduler import CrawlRunning, Poller, acquire, lock_file, run_daemon
+    try:
+        if options.daemon:
+            from jiracrawler.projects import ProjectCrawlers
+            poller = Poller(ProjectCrawlers(profile_names, options.project_workers, profiles,
+                refresh_metadata=options.refresh_metadata), crawl,
+                lambda stats: write_stats(stats, options), options.interval,
+                options.max_interval, options.jitter)
+            run_daemon(poller, lock_path, options.foreground, handler.stream)
+            return
+        lock = lock_file(lock_path)
+        acquire(lock)
+    except CrawlRunning, e:
+        logger.error("%s", e)
+        sys.exit(1)
+
+    try:
+        if options.profiles:
+            from jiracrawler.projects import crawl_projects
+            crawlers = crawl_projects(profile_names, crawl, options.project_workers, profiles,
+                refresh_metadata=options.refresh_metadata)
+            write_stats([crawler.stats for crawler in crawlers], options)
+            if len(crawlers) < len(profile_names):
+                sys.exit(1)
+            return
+
+        crawler = JiraCrawler(profile_name, refresh_metadata=options.refresh_metadata)
+        try:
+            crawl(crawler)
+        finally:
+            crawler.close()
+        crawler.stats.finish()
+        write_stats([crawler.stats], options)
+    finally:
+        lock.release()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,110 @@
+import logging
+import warnings
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import SAWarning
+from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.engine.url import make_url
+
+
+logger = logging.getLogger(__name__)
+
+
+def database_url(config, project_name):
+    """Returns db_url of the profile or a MySQL URL made of db_name, db_user and db_pass"""
+    if 'db_url' in config:
+        return config['db_url']
+
+    if 'db_name' in config:
+        db_name = config['db_name']
+    else:
+        db_name = '%s_jira' % project_name.lower()
+
+    if 'db_user' in config:
+        db_user = config['db_user']
+    else:
+        db_user = 'root'
+
+    if 'db_pass' in config:
+        db_pass = config['db_pass']
+    else:
+        db_pass = ''
+
+    return 'mysql://%s:%s@localhost/%s' % (db_user, db_pass, db_name)
+
+
+def sqlite_pragmas(synchronous):
+    def connect(dbapi_con, con_record):
+        cursor = dbapi_con.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=%s' % synchronous)
+        cursor.close()
+    return connect
+
+
+def make_engine(config, project_name, bulk_load=False, streaming=False):
+    """Creates engine for the database of the profile
+
+    SQLite databases are switched to WAL journal with synchronous=NORMAL,
+    which syncs only at checkpoints and can't corrupt the database. Bulk
+    loads use sqlite_synchronous of the profile instead when it's set.
+    Streaming engines keep results on the server until they are fetched.
+    """
+    url = make_url(database_url(config, project_name))
+    logger.info("Using database %s to store data", url.database)
+
+    options = {'echo': False}
+    if 'db_isolation_level' in config:
+        options['isolation_level'] = config['db_isolation_level']
+
+    if url.drivername.startswith('sqlite'):
+        if bulk_load and 'sqlite_synchronous' in config:
+            synchronous = config['sqlite_synchronous']
+        else:
+            synchronous = 'NORMAL'
+        engine = create_engine(url, **options)
+        event.listen(engine, 'connect', sqlite_pragmas(synchronous))
+        return engine
+
+    if streaming and url.drivername in ('mysql', 'mysql+mysqldb'):
+        import MySQLdb.cursors
+        options['connect_args'] = {'cursorclass': MySQLdb.cursors.SSCursor}
+    elif streaming and url.drivername.startswith('postgresql'):
+        options['server_side_cursors'] = True
+
+    if 'db_pool_size' in config:
+        options['pool_size'] = int(config['db_pool_size'])
+    if 'db_pool_recycle' in config:
+        options['pool_recycle'] = int(config['db_pool_recycle'])
+    return create_engine(url, **options)
+
+
+def upgrade_schema(engine, metadata):
+    """Adds columns and indexes missing from tables created by older versions of the crawler
+
+    create_all only creates missing tables. Added columns have to be
+    nullable, existing rows get NULL in them.
+    """
+    inspector = Inspector.from_engine(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        # Only names are needed, SQLite reflection warns about types it
+        # doesn't know, like BIGINT
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', SAWarning)
+            existing_columns = set(c['name'] for c in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            logger.info("Adding column %s to table %s", column.name, table.name)
+            engine.execute('ALTER TABLE %s ADD COLUMN %s %s' % (preparer.format_table(table),
+                preparer.format_column(column), column.type.compile(dialect=engine.dialect)))
+
+        existing_indexes = set(i['name'] for i in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logger.info("Creating index %s", index.name)
+                index.create(engine)
@@ -0,0 +1,409 @@
+"""In-process stand-in for JIRA SOAP service used by benchmarks
+
+It implements the part of the service the crawler calls, understands the
+JQL the crawler generates and serves either a synthetic project or a
+fixture recorded from a real JIRA with RecordingService.
+"""
+
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+# strptime imports this lazily, which isn't thread safe
+import _strptime
+
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class RemoteObject(object):
+    """Plain object with the attributes of SOAP structures"""
+
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+    def __repr__(self):
+        return 'RemoteObject(%s)' % ', '.join('%s=%r' % a for a in sorted(self.__dict__.items()))
+
+
+def key_number(key):
+    return int(key.rsplit('-', 1)[1])
+
+
+def synthetic_project(key='BENCH', issues=1000, versions=10, subtask_ratio=0.3,
+        worklogs_per_issue=3, seed=0):
+    """Returns fixture of a generated project, the same for the same arguments"""
+    rnd = random.Random(seed)
+    start = datetime(2011, 1, 1)
+
+    fixture = {
+        'project': {'id': '10000', 'key': key, 'name': key},
+        'issue_types': [{'id': '1', 'name': 'Task', 'subTask': False},
+            {'id': '2', 'name': 'Bug', 'subTask': False}],
+        'subtask_types': [{'id': '5', 'name': 'Sub-task', 'subTask': True}],
+        'statuses': [{'id': '1', 'name': 'Open'}, {'id': '3', 'name': 'In Progress'},
+            {'id': '6', 'name': 'Closed'}],
+        'versions': [{'id': str(10000 + i), 'name': '%s.%s' % (i / 10 + 1, i % 10),
+            'releaseDate': None, 'archived': False} for i in range(versions)],
+        'issues': [],
+        'worklogs': {},
+        'parents': {},
+    }
+
+    tasks = []
+    worklog_id = 10000
+    for n in range(1, issues + 1):
+        issue_key = '%s-%s' % (key, n)
+        subtask = bool(tasks) and rnd.random() < subtask_ratio
+        created = start + timedelta(minutes=n)
+        fix_versions = rnd.sample(fixture['versions'], rnd.choice([0, 1, 1, 1, 2]))
+        fixture['issues'].append({
+            'id': str(10000 + n),
+            'key': issue_key,
+            'type': '5' if subtask else rnd.choice(['1', '2']),
+            'summary': 'Generated issue %s' % n,
+            'assignee': 'developer%s' % rnd.randint(1, 20),
+            'created': created,
+            'updated': created + timedelta(minutes=rnd.randint(0, 60 * 24 * 30)),
+            'duedate': None,
+            'status': rnd.choice(fixture['statuses'])['id'],
+            'fixVersions': [dict(v) for v in fix_versions],
+        })
+        if subtask:
+            fixture['parents'][issue_key] = rnd.choice(tasks)
+        else:
+            tasks.append(issue_key)
+
+        worklogs = []
+        for i in range(rnd.randint(0, worklogs_per_issue * 2)):
+            worklog_id += 1
+            worklogs.append({
+                'id': str(worklog_id),
+                'author': 'developer%s' % rnd.randint(1, 20),
+                'created': created + timedelta(hours=rnd.randint(0, 24 * 60)),
+                'timeSpentInSeconds': rnd.randint(1, 16) * 1800,
+            })
+        fixture['worklogs'][issue_key] = worklogs
+
+    return fixture
+
+
+def to_remote(value):
+    if isinstance(value, dict):
+        return RemoteObject(**dict((str(k), to_remote(v)) for (k, v) in value.items()))
+    if isinstance(value, list):
+        return [to_remote(v) for v in value]
+    return value
+
+
+def from_remote(value):
+    if isinstance(value, (list, tuple)):
+        return [from_remote(v) for v in value]
+    if hasattr(value, '__dict__'):
+        return dict((k, from_remote(v)) for (k, v) in value.__dict__.items()
+            if not k.startswith('_'))
+    if hasattr(value, '__keylist__'):
+        # suds objects keep their attributes aside of __dict__
+        return dict((k, from_remote(getattr(value, k))) for k in value.__keylist__)
+    return value
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    raise TypeError(repr(value))
+
+
+def parse_dates(value):
+    if isinstance(value, dict):
+        return dict((k, parse_dates(v)) for (k, v) in value.items())
+    if isinstance(value, list):
+        return [parse_dates(v) for v in value]
+    if isinstance(value, basestring) and re.match(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d$', value):
+        return datetime.strptime(value, DATETIME_FORMAT)
+    return value
+
+
+def save_fixture(fixture, path):
+    with open(path, 'w') as f:
+        json.dump(fixture, f, default=json_default)
+
+
+def load_fixture(path):
+    with open(path) as f:
+        return parse_dates(json.load(f))
+
+
+class FakeJiraService(object):
+    """Serves a fixture through the JIRA SOAP methods used by the crawler
+
+    Every call sleeps for latency seconds and is counted in calls.
+    """
+
+    def __init__(self, fixture, latency=0):
+        self.latency = latency
+        self.calls = {}
+        self.lock = threading.Lock()
+
+        self.project = to_remote(fixture['project'])
+        self.issue_types = to_remote(fixture['issue_types'])
+        self.subtask_types = to_remote(fixture['subtask_types'])
+        self.statuses = to_remote(fixture['statuses'])
+        self.versions = to_remote(fixture['versions'])
+        self.parents = dict(fixture['parents'])
+        self.worklogs = dict((k, to_remote(v)) for (k, v) in fixture['worklogs'].items())
+
+        self.issues = sorted(to_remote(fixture['issues']), key=lambda i: key_number(i.key))
+        self.numbers = [key_number(i.key) for i in self.issues]
+        self.by_key = dict((i.key, i) for i in self.issues)
+        self.subtasks = {}
+        for (subtask, parent) in self.parents.items():
+            self.subtasks.setdefault(parent, []).append(subtask)
+
+    def call(self, method):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def getProjectByKey(self, auth, key):
+        self.call('getProjectByKey')
+        return self.project
+
+    def getIssueTypesForProject(self, auth, project_id):
+        self.call('getIssueTypesForProject')
+        return list(self.issue_types)
+
+    def getSubTaskIssueTypesForProject(self, auth, project_id):
+        self.call('getSubTaskIssueTypesForProject')
+        return list(self.subtask_types)
+
+    def getStatuses(self, auth):
+        self.call('getStatuses')
+        return list(self.statuses)
+
+    def getVersions(self, auth, project_key):
+        self.call('getVersions')
+        return list(self.versions)
+
+    def getWorklogs(self, auth, issue_key):
+        self.call('getWorklogs')
+        return list(self.worklogs.get(issue_key, []))
+
+    def getIssuesFromJqlSearch(self, auth, jql, max_results):
+        self.call('getIssuesFromJqlSearch')
+        (candidates, predicates) = self.compile(jql)
+        result = []
+        for issue in candidates:
+            if all(predicate(issue) for predicate in predicates):
+                result.append(issue)
+                if len(result) == max_results:
+                    break
+        return result
+
+    def compile(self, jql):
+        """Returns candidate issues in key order and predicates they have to match"""
+        jql = re.sub(r'(?i)\s+order by issuekey asc\s*$', '', jql)
+        clauses = []
+        while True:
+            m = re.match(r'^\((.*)\) and (issuekey > "[^"]*")$', jql)
+            if not m:
+                break
+            clauses.append(m.group(2))
+            jql = m.group(1)
+        if len(self.split(jql, 'or')) > 1:
+            clauses.append('(%s)' % jql)
+        else:
+            clauses.extend(self.split(jql, 'and'))
+
+        after = 0
+        keys = None
+        predicates = []
+        for clause in clauses:
+            m = re.match(r'issuekey > "(.*)"$', clause)
+            if m:
+                after = max(after, key_number(m.group(1)))
+                continue
+            clause_keys = self.keys(clause)
+            if clause_keys is not None:
+                keys = clause_keys if keys is None else keys & clause_keys
+            predicates.append(self.predicate(clause))
+
+        if keys is not None:
+            candidates = sorted((self.by_key[key] for key in keys
+                if key in self.by_key and key_number(key) > after), key=lambda i: key_number(i.key))
+        else:
+            candidates = (self.issues[n] for n in
+                xrange(bisect.bisect_right(self.numbers, after), len(self.issues)))
+        return (candidates, predicates)
+
+    def split(self, jql, operator):
+        """Splits JQL on top level operator keeping parenthesized groups whole"""
+        separator = r'\s+%s\s+' % operator
+        clauses = []
+        depth = 0
+        current = ''
+        for token in re.split(r'(\(|\)|%s)' % separator, jql):
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+            elif re.match(separator + '$', token) and depth == 0:
+                clauses.append(current.strip())
+                current = ''
+                continue
+            current += token
+        clauses.append(current.strip())
+        return [c for c in clauses if c]
+
+    def group(self, clause):
+        """Returns the inside of a clause wrapped in parentheses as a whole, if it is"""
+        if not clause.startswith('('):
+            return None
+        depth = 0
+        for (n, char) in enumerate(clause):
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            if depth == 0:
+                return clause[1:-1] if n == len(clause) - 1 else None
+        return None
+
+    def names(self, values):
+        return [v.strip().strip('"\'') for v in values.split(',')]
+
+    def keys(self, clause):
+        """Returns keys of the only issues the clause can match, None if it can match any"""
+        group = self.group(clause)
+        if group is not None:
+            alternatives = self.split(group, 'or')
+            if len(alternatives) > 1:
+                alternatives = [self.keys(c) for c in alternatives]
+                if None in alternatives:
+                    return None
+                return set().union(*alternatives)
+            keys = [k for k in (self.keys(c) for c in self.split(group, 'and')) if k is not None]
+            return set.intersection(*keys) if keys else None
+        m = re.match(r'parent in \((.*)\)$', clause)
+        if m:
+            return set(key for parent in self.names(m.group(1))
+                for key in self.subtasks.get(parent, []))
+        m = re.match(r'parent = "(.*)"$', clause)
+        if m:
+            return set(self.subtasks.get(m.group(1), []))
+        m = re.match(r'issuekey in \((.*)\)$', clause)
+        if m:
+            return set(self.names(m.group(1)))
+        return None
+
+    def predicate(self, clause):
+        group = self.group(clause)
+        if group is not None:
+            alternatives = self.split(group, 'or')
+            if len(alternatives) > 1:
+                alternatives = [self.predicate(c) for c in alternatives]
+                return lambda i: any(p(i) for p in alternatives)
+            conditions = [self.predicate(c) for c in self.split(group, 'and')]
+            return lambda i: all(p(i) for p in conditions)
+        m = re.match(r'project = (\S+)$', clause)
+        if m:
+            return lambda i: True
+        m = re.match(r"fixVersion = '(.*)'$", clause)
+        if m:
+            name = m.group(1)
+            return lambda i: name in [v.name for v in i.fixVersions]
+        m = re.match(r'fixVersion in \((.*)\)$', clause)
+        if m:
+            names = set(self.names(m.group(1)))
+            return lambda i: bool(names.intersection(v.name for v in i.fixVersions))
+        if clause == 'fixVersion is EMPTY':
+            return lambda i: not i.fixVersions
+        m = re.match(r"updated >= '(.*)'$", clause)
+        if m:
+            since = datetime.strptime(m.group(1), '%Y/%m/%d %H:%M')
+            return lambda i: i.updated >= since
+        m = re.match(r'parent = "(.*)"$', clause)
+        if m:
+            parent = m.group(1)
+            return lambda i: self.parents.get(i.key) == parent
+        m = re.match(r'parent in \((.*)\)$', clause)
+        if m:
+            parents = set(self.names(m.group(1)))
+            return lambda i: self.parents.get(i.key) in parents
+        m = re.match(r'issuekey in \((.*)\)$', clause)
+        if m:
+            keys = set(self.names(m.group(1)))
+            return lambda i: i.key in keys
+        raise ValueError("Unsupported JQL clause: %s" % clause)
+
+
+class RecordingService(object):
+    """Proxy to a real JIRA service collecting the responses into a fixture
+
+    SOAP issues don't tell their parents, fixture['parents'] has to be
+    filled from the database of the recorded crawl.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self.fixture = {'project': None, 'issue_types': [], 'subtask_types': [],
+            'statuses': [], 'versions': [], 'issues': [], 'worklogs': {}, 'parents': {}}
+        self.issue_keys = set()
+
+    def getProjectByKey(self, auth, key):
+        project = self.service.getProjectByKey(auth, key)
+        self.fixture['project'] = from_remote(project)
+        return project
+
+    def getIssueTypesForProject(self, auth, project_id):
+        types = self.service.getIssueTypesForProject(auth, project_id)
+        self.fixture['issue_types'] = from_remote(types)
+        return types
+
+    def getSubTaskIssueTypesForProject(self, auth, project_id):
+        types = self.service.getSubTaskIssueTypesForProject(auth, project_id)
+        self.fixture['subtask_types'] = from_remote(types)
+        return types
+
+    def getStatuses(self, auth):
+        statuses = self.service.getStatuses(auth)
+        self.fixture['statuses'] = from_remote(statuses)
+        return statuses
+
+    def getVersions(self, auth, project_key):
+        versions = self.service.getVersions(auth, project_key)
+        self.fixture['versions'] = from_remote(versions)
+        return versions
+
+    def getWorklogs(self, auth, issue_key):
+        worklogs = self.service.getWorklogs(auth, issue_key)
+        self.fixture['worklogs'][issue_key] = from_remote(worklogs)
+        return worklogs
+
+    def getIssuesFromJqlSearch(self, auth, jql, max_results):
+        issues = self.service.getIssuesFromJqlSearch(auth, jql, max_results)
+        for issue in issues:
+            if issue.key not in self.issue_keys:
+                self.issue_keys.add(issue.key)
+                self.fixture['issues'].append(from_remote(issue))
+        return issues
+
+
+class FakeJiraConnection(object):
+    """Looks like jirareports JiraConnection serving a FakeJiraService"""
+
+    def __init__(self, service, config=None):
+        self.service = service
+        self.auth = 'fake-token'
+        self.project_name = service.project.key
+        self.config = config or {}
+
+    def to_datetime(self, value):
+        return value
+
+    def int_arg(self, value):
+        return value
@@ -0,0 +1,131 @@
+"""Compact collections of issue ids
+
+Crawls of big projects keep ids of every stored and every found issue.
+Python sets and dicts of ints take around a hundred bytes per id, these
+keep ids and update times in arrays of 8 byte integers.
+"""
+
+import calendar
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from itertools import izip
+
+
+class IdSet(object):
+    """Set of integer ids in a sorted array
+
+    Ids are appended as they come and sorted on the first lookup after.
+    """
+
+    def __init__(self, ids=()):
+        self.ids = array('l')
+        self.sorted = True
+        self.update(ids)
+
+    def add(self, id):
+        self.ids.append(id)
+        self.sorted = False
+
+    def update(self, ids):
+        self.ids.extend(ids)
+        self.sorted = False
+
+    def sort(self):
+        if self.sorted:
+            return
+        ids = array('l')
+        for id in sorted(self.ids):
+            if not ids or ids[-1] != id:
+                ids.append(id)
+        (self.ids, self.sorted) = (ids, True)
+
+    def __contains__(self, id):
+        self.sort()
+        i = bisect_left(self.ids, id)
+        return i < len(self.ids) and self.ids[i] == id
+
+    def __len__(self):
+        self.sort()
+        return len(self.ids)
+
+    def __iter__(self):
+        self.sort()
+        return iter(self.ids)
+
+
+class IdPairs(object):
+    """Pairs of ids in two arrays, e.g. links of subtasks to their parents
+
+    Pairs may be added by several threads at once.
+    """
+
+    def __init__(self, pairs=()):
+        self.first = array('l')
+        self.second = array('l')
+        self.lock = threading.Lock()
+        self.extend(pairs)
+
+    def add(self, first, second):
+        with self.lock:
+            self.first.append(first)
+            self.second.append(second)
+
+    def extend(self, pairs):
+        for (first, second) in pairs:
+            self.add(first, second)
+
+    def __len__(self):
+        return len(self.first)
+
+    def __iter__(self):
+        return izip(self.first, self.second)
+
+
+class StoredIssues(object):
+    """Update times and fingerprints of stored issues by their ids, in sorted arrays
+
+    Update times are kept in whole seconds, which is all the database keeps.
+    """
+
+    def __init__(self, rows):
+        """rows are (id, update time, fingerprint) tuples sorted by id"""
+        self.ids = array('l')
+        self.updates = array('l')
+        self.fingerprints = array('l')
+        for (id, updated_at, fingerprint) in rows:
+            self.ids.append(id)
+            self.updates.append(calendar.timegm(updated_at.timetuple()) if updated_at else -1)
+            # Zero stands for rows stored before fingerprints, a real one is
+            # hardly ever zero and would just be written again
+            self.fingerprints.append(fingerprint or 0)
+
+    def index(self, id):
+        i = bisect_left(self.ids, id)
+        if i == len(self.ids) or self.ids[i] != id:
+            return None
+        return i
+
+    def get(self, id, default=None):
+        i = self.index(id)
+        if i is None:
+            return default
+        if self.updates[i] == -1:
+            return None
+        return datetime.utcfromtimestamp(self.updates[i])
+
+    def fingerprint(self, id):
+        i = self.index(id)
+        if i is None or self.fingerprints[i] == 0:
+            return None
+        return self.fingerprints[i]
+
+    def __contains__(self, id):
+        return self.index(id) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
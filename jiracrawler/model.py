@@ -1,6 +1,6 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import (Column, Integer, String,
-    Date, DateTime, Boolean)
+from sqlalchemy import (Column, Integer, BigInteger, String,
+    Date, DateTime, Boolean, Text)
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declared_attr
@@ -13,7 +13,6 @@ class Base(object):
         return cls.__name__.lower()
 
     __table_args__ = {'mysql_engine': 'InnoDB'}
-    __mapper_args__= {'always_refresh': True}
 
 
 Base = declarative_base(cls=Base)
@@ -41,8 +40,10 @@ class Issue(Base):
     created_at = Column(DateTime(), nullable=False)
     due_date = Column(Date())
     parent_id = Column(Integer, ForeignKey('issue.id'))
-    fix_version_id = Column(Integer, ForeignKey('version.id'))
+    fix_version_id = Column(Integer, ForeignKey('version.id'), index=True)
     status_id = Column(Integer, ForeignKey('status.id'), nullable=False)
+    updated_at = Column(DateTime())
+    fingerprint = Column(BigInteger)
 
     subtasks = relationship("Issue", backref=backref("parent", remote_side=[id]))
     fix_version = relationship("Version", backref=backref("issues", order_by=id))
@@ -52,7 +53,53 @@ class Issue(Base):
 
 class Worklog(Base):
     id =  Column(Integer, primary_key=True)
-    created_at = Column(DateTime(), nullable=False)
+    created_at = Column(DateTime(), nullable=False, index=True)
     author = Column(String(20), nullable=False)
     time_spent = Column(Integer, nullable=False)
-    issue_id = Column(Integer, ForeignKey('issue.id', ondelete='CASCADE'), nullable=False)
+    issue_id = Column(Integer, ForeignKey('issue.id', ondelete='CASCADE'), nullable=False,
+        index=True)
+    fingerprint = Column(BigInteger)
+
+
+class SyncState(Base):
+    project = Column(String(10), primary_key=True)
+    updated_at = Column(DateTime())
+    full_sync_at = Column(DateTime())
+    worklogs_checked_at = Column(DateTime())
+
+
+class DailyAuthorWork(Base):
+    id = Column(Integer, primary_key=True)
+    date = Column(Date(), nullable=False, index=True)
+    version_id = Column(Integer, index=True)
+    author = Column(String(20), nullable=False)
+    time_spent = Column(Integer, nullable=False)
+
+
+class DailyTaskWork(Base):
+    id = Column(Integer, primary_key=True)
+    date = Column(Date(), nullable=False, index=True)
+    task_id = Column(Integer, nullable=False, index=True)
+    time_spent = Column(Integer, nullable=False)
+
+
+class CrawlCheckpoint(Base):
+    project = Column(String(10), primary_key=True)
+    crawl = Column(String(50), primary_key=True)
+    since = Column(DateTime())
+    last_key = Column(String(20))
+    last_update = Column(DateTime())
+    done = Column(Boolean, nullable=False, default=False)
+
+
+class IssueTombstone(Base):
+    id = Column(Integer, primary_key=True)
+    key = Column(String(10), nullable=False)
+    fix_version_id = Column(Integer)
+    deleted_at = Column(DateTime(), nullable=False, index=True)
+
+
+class MetadataCache(Base):
+    key = Column(String(100), primary_key=True)
+    value = Column(Text, nullable=False)
+    fetched_at = Column(DateTime(), nullable=False)
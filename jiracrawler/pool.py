@@ -0,0 +1,100 @@
+import logging
+import threading
+import Queue
+
+
+logger = logging.getLogger(__name__)
+
+
+def map_parallel(function, items, contexts):
+    """Returns results of function(context, item) for items in their order
+
+    Every context gets its own thread which takes items one by one, so
+    contexts don't have to be thread safe. The first error is raised after
+    all threads stop.
+    """
+    tasks = Queue.Queue()
+    for task in enumerate(items):
+        tasks.put(task)
+    results = [None] * len(items)
+    errors = []
+
+    def work(context):
+        while not errors:
+            try:
+                (index, item) = tasks.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                results[index] = function(context, item)
+            except Exception, e:
+                logger.exception("Worker failed")
+                errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(context,)) for context in contexts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return results
+
+
+class WorklogFetcher(object):
+    """Fetches worklogs of many issues concurrently
+
+    Every worker thread owns a JIRA connection, results are handed back
+    to the calling thread which is the only one touching the database.
+    """
+
+    def __init__(self, connections):
+        self.tasks = Queue.Queue()
+        self.results = Queue.Queue()
+        self.workers = []
+        for jira_con in connections:
+            worker = threading.Thread(target=self.work, args=(jira_con,))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        logger.info("Started %s worklog fetchers", len(self.workers))
+
+    def work(self, jira_con):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            (index, key) = task
+            try:
+                result = jira_con.service.getWorklogs(jira_con.auth, key)
+            except Exception, e:
+                logger.error("Can't fetch worklogs of issue %s", key)
+                result = e
+            self.results.put((index, result))
+
+    def fetch(self, keys):
+        """Returns lists of worklogs in the order of issue keys"""
+        for task in enumerate(keys):
+            self.tasks.put(task)
+
+        worklogs = [None] * len(keys)
+        error = None
+        for i in range(len(keys)):
+            (index, result) = self.results.get()
+            if isinstance(result, Exception):
+                error = error or result
+            else:
+                worklogs[index] = result
+
+        # All results are collected before failing so none of them leaks
+        # into the next batch
+        if error:
+            raise error
+        return worklogs
+
+    def close(self):
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
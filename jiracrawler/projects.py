@@ -0,0 +1,187 @@
+"""Crawling several projects in one process
+
+Projects on the same JIRA server under the same user share a single
+JIRA connection, so the SOAP client is set up and logged in once. Global
+metadata like statuses is fetched once per server and calls to the same
+server are throttled together.
+"""
+
+import logging
+import threading
+from functools import partial
+
+from jiracrawler.cache import SharedMetadata
+from jiracrawler.config import jira_connection, read_profiles
+from jiracrawler.crawler import JiraCrawler
+from jiracrawler.pool import map_parallel
+from jiracrawler.throttle import Throttle
+
+
+logger = logging.getLogger(__name__)
+
+class ProjectConnection(object):
+    """Connection of a profile using JIRA session of another connection"""
+
+    def __init__(self, jira_con, config):
+        self.jira_con = jira_con
+        self.auth = jira_con.auth
+        self.service = jira_con.service
+        self.project_name = config['project']
+        self.config = config
+
+    def to_datetime(self, value):
+        return self.jira_con.to_datetime(value)
+
+    def int_arg(self, value):
+        return self.jira_con.int_arg(value)
+
+
+class SharedConnections(object):
+    """Opens one JIRA connection per server and user
+
+    Connections are not thread safe, projects sharing them have to be
+    crawled by the same thread.
+    """
+
+    def __init__(self, profiles):
+        self.profiles = profiles
+        self.connections = {}
+
+    def key(self, profile_name):
+        config = self.profiles.get(profile_name)
+        if config is None or config.get('share_connection', 'true').lower() not in (
+                'true', 'yes', 'on', '1'):
+            return None
+        return (config.get('uri'), config.get('username'), config.get('api', 'soap').lower())
+
+    def connect(self, profile_name):
+        key = self.key(profile_name)
+        if key is None:
+            return jira_connection(profile_name, self.profiles)
+
+        if key not in self.connections:
+            self.connections[key] = jira_connection(profile_name, self.profiles)
+            return self.connections[key]
+        logger.info("Reusing JIRA connection to %s for profile %s", key[0], profile_name)
+        return ProjectConnection(self.connections[key], self.profiles[profile_name])
+
+    def discard(self, profile_name):
+        """Forgets connection of the profile, e.g. after its session expired"""
+        self.connections.pop(self.key(profile_name), None)
+
+
+class ProjectCrawlers(object):
+    """Crawlers of several projects kept open between crawls
+
+    Projects are split between project_workers groups up front, every group
+    is crawled by one thread at a time and has its own shared connections.
+    """
+
+    def __init__(self, profile_names, project_workers=1, profiles=None, refresh_metadata=False):
+        if profiles is None:
+            profiles = read_profiles()
+        unknown = [name for name in profile_names if name is not None and name not in profiles]
+        if unknown:
+            raise ValueError("Unknown profiles: %s" % ', '.join(unknown))
+
+        self.profiles = profiles
+        self.metadata = SharedMetadata()
+        self.lock = threading.Lock()
+        self.throttles = {}
+        workers = max(min(project_workers, len(profile_names)), 1)
+        self.groups = [(SharedConnections(profiles), profile_names[i::workers])
+            for i in range(workers)]
+        self.crawlers = {}
+        # Profiles whose crawlers start with metadata fetched from JIRA
+        self.refresh = set(profile_names) if refresh_metadata else set()
+
+    def throttle(self, profile_name):
+        """Returns throttle of JIRA server of the profile, made from the first profile asking"""
+        config = self.profiles.get(profile_name)
+        if config is None:
+            return None
+        with self.lock:
+            if config.get('uri') not in self.throttles:
+                self.throttles[config.get('uri')] = Throttle.from_config(config)
+            return self.throttles[config.get('uri')]
+
+    def crawler(self, connections, profile_name):
+        if profile_name not in self.crawlers:
+            self.crawlers[profile_name] = JiraCrawler(profile_name,
+                jira_con=connections.connect(profile_name),
+                connect=partial(jira_connection, profile_name, self.profiles),
+                metadata=self.metadata, refresh_metadata=profile_name in self.refresh,
+                throttle=self.throttle(profile_name))
+            self.refresh.discard(profile_name)
+        return self.crawlers[profile_name]
+
+    def discard(self, connections, profile_name):
+        """Closes crawler of the profile so the next crawl starts from scratch"""
+        crawler = self.crawlers.pop(profile_name, None)
+        if crawler:
+            crawler.close()
+            crawler.session.close()
+        connections.discard(profile_name)
+        # Metadata may be the reason of the failure, e.g. a new status
+        self.metadata.clear()
+        self.refresh.add(profile_name)
+
+    def crawl_project(self, connections, profile_name, crawl):
+        """Returns (crawler, result of crawl(crawler)) or None when crawling failed"""
+        logger.info("Crawling project of profile %s", profile_name or "default")
+        started = profile_name in self.crawlers
+        try:
+            crawler = self.crawler(connections, profile_name)
+        except Exception:
+            logger.exception("Can't start crawling profile %s", profile_name)
+            connections.discard(profile_name)
+            return None
+
+        crawler.stats.reset()
+        try:
+            # Issue types are loaded when crawlers start, the cache in the
+            # database tells kept crawlers when to fetch them again
+            if started:
+                crawler.load_issue_types()
+            return (crawler, crawl(crawler))
+        except Exception:
+            logger.exception("Crawling profile %s failed", profile_name)
+            self.discard(connections, profile_name)
+            return None
+        finally:
+            crawler.stats.finish()
+
+    def crawl(self, crawl):
+        """Runs crawl(crawler) for every project
+
+        Returns (crawler, result) pairs of the projects crawled successfully.
+        Shared metadata is read again from the databases, where it expires
+        after metadata_ttl.
+        """
+        def crawl_group(context, (connections, profile_names)):
+            return [self.crawl_project(connections, profile_name, crawl)
+                for profile_name in profile_names]
+
+        self.metadata.clear()
+        results = map_parallel(crawl_group, self.groups, range(len(self.groups)))
+        return [result for group in results for result in group if result]
+
+    def close(self):
+        for crawler in self.crawlers.values():
+            crawler.close()
+            crawler.session.close()
+        self.crawlers = {}
+
+
+def crawl_projects(profile_names, crawl, project_workers=1, profiles=None,
+        refresh_metadata=False):
+    """Runs crawl(crawler) for projects of the profiles once
+
+    Up to project_workers projects are crawled at once. Returns crawlers of
+    the projects crawled successfully.
+    """
+    crawlers = ProjectCrawlers(profile_names, project_workers, profiles, refresh_metadata)
+    try:
+        return [crawler for (crawler, result) in crawlers.crawl(crawl)]
+    finally:
+        crawlers.close()
@@ -0,0 +1,189 @@
+"""Standard reports over the crawled database
+
+Reports are range queries over indexed date columns, mostly of the rollup
+tables. Rows are streamed from a server side cursor and written as CSV or
+JSON as they come, so exports of any size run in constant memory.
+"""
+
+import csv
+import json
+import sys
+from datetime import date, datetime, timedelta
+from optparse import OptionParser
+
+from sqlalchemy import and_, func, select
+
+from jiracrawler.db import make_engine
+from jiracrawler.model import DailyAuthorWork, DailyTaskWork, Issue, Status, Version, Worklog
+
+
+# Rows fetched from the cursor at once
+FETCH_SIZE = 1000
+
+
+def developer_days(start, end, version=None):
+    """Hours logged by every developer per day and version"""
+    work = DailyAuthorWork.__table__
+    versions = Version.__table__
+    query = select([work.c.date, versions.c.name.label('version'), work.c.author,
+            work.c.time_spent],
+        and_(work.c.date >= start, work.c.date <= end),
+        from_obj=[work.outerjoin(versions, versions.c.id == work.c.version_id)])
+    if version:
+        query = query.where(versions.c.name == version)
+    return query.order_by(work.c.date, versions.c.name, work.c.author)
+
+
+def developers(start, end, version=None):
+    """Hours logged by every developer per version within the date range"""
+    work = DailyAuthorWork.__table__
+    versions = Version.__table__
+    query = select([versions.c.name.label('version'), work.c.author,
+            func.sum(work.c.time_spent).label('time_spent')],
+        and_(work.c.date >= start, work.c.date <= end),
+        from_obj=[work.outerjoin(versions, versions.c.id == work.c.version_id)])
+    if version:
+        query = query.where(versions.c.name == version)
+    return query.group_by(versions.c.name, work.c.author)\
+        .order_by(versions.c.name, work.c.author)
+
+
+def tasks(start, end, version=None):
+    """Hours logged per day on every top-level task including its subtasks"""
+    work = DailyTaskWork.__table__
+    issues = Issue.__table__
+    versions = Version.__table__
+    statuses = Status.__table__
+    query = select([work.c.date, versions.c.name.label('version'), issues.c.key,
+            issues.c.summary, statuses.c.name.label('status'), issues.c.due_date,
+            work.c.time_spent],
+        and_(work.c.date >= start, work.c.date <= end),
+        from_obj=[work.join(issues, issues.c.id == work.c.task_id)\
+            .join(statuses, statuses.c.id == issues.c.status_id)\
+            .outerjoin(versions, versions.c.id == issues.c.fix_version_id)])
+    if version:
+        query = query.where(versions.c.name == version)
+    return query.order_by(work.c.date, issues.c.key)
+
+
+def worklogs(start, end, version=None):
+    """Every worklog created within the date range"""
+    worklog = Worklog.__table__
+    issues = Issue.__table__
+    versions = Version.__table__
+    # Range on created_at rather than date(created_at) keeps the index usable
+    query = select([worklog.c.created_at, versions.c.name.label('version'), issues.c.key,
+            worklog.c.author, worklog.c.time_spent],
+        and_(worklog.c.created_at >= datetime(start.year, start.month, start.day),
+            worklog.c.created_at < datetime(end.year, end.month, end.day) + timedelta(days=1)),
+        from_obj=[worklog.join(issues, issues.c.id == worklog.c.issue_id)\
+            .outerjoin(versions, versions.c.id == issues.c.fix_version_id)])
+    if version:
+        query = query.where(versions.c.name == version)
+    return query.order_by(worklog.c.created_at)
+
+
+REPORTS = {
+    'developer-days': developer_days,
+    'developers': developers,
+    'tasks': tasks,
+    'worklogs': worklogs,
+}
+
+
+def output_columns(query):
+    return [('hours' if c.name == 'time_spent' else c.name) for c in query.c]
+
+
+def stream_rows(connection, query):
+    """Yields rows of the query as dicts with time spent in hours"""
+    columns = output_columns(query)
+    result = connection.execution_options(stream_results=True).execute(query)
+    try:
+        while True:
+            rows = result.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield dict((column, round(float(value) / 3600, 2)
+                        if column == 'hours' and value is not None else value)
+                    for (column, value) in zip(columns, row))
+    finally:
+        result.close()
+
+
+def plain(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def write_csv(out, columns, rows):
+    writer = csv.writer(out)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([plain(row[c]) for c in columns])
+
+
+def write_json(out, columns, rows):
+    """Writes rows as JSON array, one object per line"""
+    out.write('[')
+    separator = '\n'
+    for row in rows:
+        out.write(separator)
+        out.write(json.dumps(dict((c, plain(row[c])) for c in columns), sort_keys=True))
+        separator = ',\n'
+    out.write('\n]\n')
+
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def main(args=None, profiles=None):
+    parser = OptionParser(usage="%%prog report [options] REPORT [profile]\n\nReports: %s" %
+        ', '.join(sorted(REPORTS)))
+    parser.add_option("--from", dest="start", metavar="YYYY-MM-DD",
+        help="first day of the report, today by default")
+    parser.add_option("--to", dest="end", metavar="YYYY-MM-DD",
+        help="last day of the report, the first one by default")
+    parser.add_option("--version", help="report only issues of the fix version")
+    parser.add_option("--format", choices=['csv', 'json'], default='csv',
+        help="csv (default) or json")
+    parser.add_option("-o", "--output", metavar="FILE", help="write to the file instead of stdout")
+    (options, args) = parser.parse_args(args)
+
+    if not args or args[0] not in REPORTS or len(args) > 2:
+        parser.error("choose one of the reports: %s" % ', '.join(sorted(REPORTS)))
+    try:
+        start = parse_date(options.start) if options.start else date.today()
+        end = parse_date(options.end) if options.end else start
+    except ValueError, e:
+        parser.error(str(e))
+
+    profile_name = args[1] if len(args) > 1 else 'default'
+    if profiles is None:
+        from jiracrawler.config import read_profiles
+        profiles = read_profiles()
+    if profile_name not in profiles:
+        parser.error("Unknown profile %s" % profile_name)
+    config = profiles[profile_name]
+    if not ('db_url' in config or 'db_name' in config or 'project' in config):
+        parser.error("Profile %s sets neither db_url nor project, its database is unknown"
+            % profile_name)
+
+    engine = make_engine(config, config.get('project'), streaming=True)
+    query = REPORTS[args[0]](start, end, options.version)
+    columns = output_columns(query)
+    write = write_csv if options.format == 'csv' else write_json
+
+    out = open(options.output, 'wb') if options.output else sys.stdout
+    connection = engine.connect()
+    try:
+        write(out, columns, stream_rows(connection, query))
+    finally:
+        connection.close()
+        if options.output:
+            out.close()
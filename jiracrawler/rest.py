@@ -0,0 +1,160 @@
+"""JIRA REST API backend
+
+RestConnection looks like jirareports JiraConnection to the crawler: its
+service answers the SOAP methods the crawler calls with plain tuples
+built from REST responses. Searches request only the fields the crawler
+stores and embed worklogs and parents of the issues, so most issues need
+no calls of their own. Requests go through one keep-alive HTTP session
+per connection with gzip compressed responses.
+"""
+
+import json
+from collections import namedtuple
+from datetime import datetime
+# strptime imports this lazily, which isn't thread safe
+import _strptime
+
+import requests
+
+# Fields of issues the crawler stores, everything else stays on the server
+ISSUE_FIELDS = ['issuetype', 'status', 'summary', 'assignee', 'created', 'updated',
+    'duedate', 'fixVersions', 'parent', 'worklog']
+
+RestProject = namedtuple('RestProject', ['id', 'key', 'name'])
+RestIssueType = namedtuple('RestIssueType', ['id', 'name', 'subTask'])
+RestStatus = namedtuple('RestStatus', ['id', 'name'])
+RestVersion = namedtuple('RestVersion', ['id', 'name', 'releaseDate', 'archived'])
+# worklogs is None when the search didn't return all of them, parentId is
+# None for issues which aren't subtasks
+RestIssue = namedtuple('RestIssue', ['id', 'key', 'type', 'status', 'summary', 'assignee',
+    'created', 'updated', 'duedate', 'fixVersions', 'parentId', 'worklogs'])
+RestWorklog = namedtuple('RestWorklog', ['id', 'author', 'created', 'timeSpentInSeconds'])
+
+
+def base_url(uri):
+    """Returns JIRA base URL of the profile uri, which may be the SOAP WSDL one"""
+    return uri.split('/rpc/soap/')[0].rstrip('/')
+
+
+def user_name(user):
+    return user['name'] if user else None
+
+
+def rest_worklog(worklog):
+    return RestWorklog(worklog['id'], user_name(worklog.get('author')), worklog['created'],
+        worklog['timeSpentSeconds'])
+
+
+def rest_issue(issue):
+    fields = issue['fields']
+    worklog = fields.get('worklog')
+    if worklog and len(worklog['worklogs']) >= worklog['total']:
+        worklogs = [rest_worklog(w) for w in worklog['worklogs']]
+    else:
+        worklogs = None
+    return RestIssue(issue['id'], issue['key'], fields['issuetype']['id'],
+        fields['status']['id'], fields['summary'], user_name(fields.get('assignee')),
+        fields['created'], fields['updated'], fields.get('duedate'),
+        [RestVersion(v['id'], v['name'], v.get('releaseDate'), v.get('archived', False))
+            for v in fields.get('fixVersions') or []],
+        fields['parent']['id'] if fields.get('parent') else None, worklogs)
+
+
+class RestService(object):
+    """JIRA REST API behind the SOAP methods used by the crawler
+
+    Not thread safe, every thread needs a connection of its own.
+    """
+
+    def __init__(self, uri, username, password, timeout=60):
+        self.url = base_url(uri) + '/rest/api/2/'
+        self.timeout = timeout
+        # Sessions keep connections alive and ask for gzip by default
+        self.http = requests.Session()
+        self.http.auth = (username, password)
+        self.http.headers.update({'Accept': 'application/json'})
+        self.projects = {}
+
+    def get(self, path, **params):
+        response = self.http.get(self.url + path, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def post(self, path, body):
+        response = self.http.post(self.url + path, data=json.dumps(body), timeout=self.timeout,
+            headers={'Content-Type': 'application/json'})
+        response.raise_for_status()
+        return response.json()
+
+    def project(self, key):
+        if key not in self.projects:
+            project = self.get('project/%s' % key)
+            # Projects are looked up by key and by id
+            self.projects[project['key']] = self.projects[project['id']] = project
+        return self.projects[key]
+
+    def issue_types(self, project_id, subtask):
+        return [RestIssueType(t['id'], t['name'], t.get('subtask', False))
+            for t in self.project(project_id)['issueTypes'] if t.get('subtask', False) == subtask]
+
+    def getProjectByKey(self, auth, key):
+        project = self.project(key)
+        return RestProject(project['id'], project['key'], project['name'])
+
+    def getIssueTypesForProject(self, auth, project_id):
+        return self.issue_types(project_id, False)
+
+    def getSubTaskIssueTypesForProject(self, auth, project_id):
+        return self.issue_types(project_id, True)
+
+    def getStatuses(self, auth):
+        return [RestStatus(s['id'], s['name']) for s in self.get('status')]
+
+    def getVersions(self, auth, project_key):
+        return [RestVersion(v['id'], v['name'], v.get('releaseDate'), v.get('archived', False))
+            for v in self.get('project/%s/versions' % project_key)]
+
+    def getWorklogs(self, auth, issue_key):
+        worklogs = []
+        while True:
+            page = self.get('issue/%s/worklog' % issue_key, startAt=len(worklogs))
+            worklogs.extend(rest_worklog(w) for w in page['worklogs'])
+            if not page['worklogs'] or len(worklogs) >= page['total']:
+                return worklogs
+
+    def getIssuesFromJqlSearch(self, auth, jql, max_results):
+        """Returns up to max_results issues with the fields the crawler stores
+
+        JIRA caps results of a single request, so pages are requested until
+        max_results issues are found or the search is exhausted.
+        """
+        issues = []
+        while len(issues) < max_results:
+            page = self.post('search', {'jql': jql, 'startAt': len(issues),
+                'maxResults': max_results - len(issues), 'fields': ISSUE_FIELDS})
+            issues.extend(rest_issue(issue) for issue in page['issues'])
+            if not page['issues'] or len(issues) >= page['total']:
+                break
+        return issues
+
+
+class RestConnection(object):
+    """Connection to JIRA REST API of a profile, used when its api option is rest"""
+
+    def __init__(self, config):
+        self.config = config
+        self.project_name = config['project']
+        # Requests are authenticated by the HTTP session itself
+        self.auth = None
+        self.service = RestService(config['uri'], config['username'], config['password'],
+            float(config.get('http_timeout', 60)))
+
+    def to_datetime(self, value):
+        # JIRA formats times in the time zone of the user, the same one JQL
+        # dates are compared in, so the offset is dropped
+        if 'T' in value:
+            return datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+        return datetime.strptime(value, '%Y-%m-%d')
+
+    def int_arg(self, value):
+        return value
@@ -0,0 +1,82 @@
+"""Reporting tables summing worklogs by day
+
+dailyauthorwork holds seconds logged by every author per day on issues of
+every version, dailytaskwork seconds logged per day on every top-level
+task including its subtasks. Crawls recompute only the days whose
+worklogs they touched.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select
+
+from jiracrawler.model import DailyAuthorWork, DailyTaskWork, Issue, Worklog
+
+
+# Days recomputed at once
+ROLLUP_BATCH = 100
+
+
+def day_ranges(dates):
+    """Returns (start, end) datetime ranges covering runs of consecutive dates"""
+    ranges = []
+    for date in sorted(dates):
+        start = datetime(date.year, date.month, date.day)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], start + timedelta(days=1))
+        else:
+            ranges.append((start, start + timedelta(days=1)))
+    return ranges
+
+
+def rollup_rows(session, dates=None):
+    """Returns rows of both rollups for worklogs of the dates, all worklogs by default"""
+    worklog = Worklog.__table__
+    issue = Issue.__table__
+    query = select([worklog.c.created_at, worklog.c.author, worklog.c.time_spent,
+            issue.c.fix_version_id, func.coalesce(issue.c.parent_id, issue.c.id)])\
+        .select_from(worklog.join(issue, issue.c.id == worklog.c.issue_id))
+    if dates is not None:
+        query = query.where(or_(*[and_(worklog.c.created_at >= start, worklog.c.created_at < end)
+            for (start, end) in day_ranges(dates)]))
+
+    authors = {}
+    tasks = {}
+    for (created_at, author, time_spent, version_id, task_id) in session.execute(query):
+        logged_on = created_at.date()
+        authors[(logged_on, version_id, author)] = \
+            authors.get((logged_on, version_id, author), 0) + time_spent
+        tasks[(logged_on, task_id)] = tasks.get((logged_on, task_id), 0) + time_spent
+
+    return ([{'date': day, 'version_id': version_id, 'author': author, 'time_spent': time_spent}
+            for ((day, version_id, author), time_spent) in authors.items()],
+        [{'date': day, 'task_id': task_id, 'time_spent': time_spent}
+            for ((day, task_id), time_spent) in tasks.items()])
+
+
+def replace_rows(session, dates, rows):
+    for (table, table_rows) in zip((DailyAuthorWork.__table__, DailyTaskWork.__table__), rows):
+        if dates is None:
+            session.execute(table.delete())
+        else:
+            session.execute(table.delete().where(table.c.date.in_(dates)))
+        if table_rows:
+            session.execute(table.insert(), table_rows)
+
+
+def rollups_missing(session):
+    """Tells if rollups are empty while there are worklogs, e.g. in an upgraded database"""
+    return (session.query(DailyTaskWork.id).first() is None and
+        session.query(Worklog.id).first() is not None)
+
+
+def refresh_rollups(session, dates=None):
+    """Recomputes rollups for the dates, all of them by default"""
+    if dates is None:
+        replace_rows(session, None, rollup_rows(session))
+        return
+
+    dates = sorted(dates)
+    for i in range(0, len(dates), ROLLUP_BATCH):
+        batch = dates[i:i + ROLLUP_BATCH]
+        replace_rows(session, batch, rollup_rows(session, batch))
@@ -0,0 +1,117 @@
+"""Daemon polling JIRA for updates
+
+The daemon keeps its crawlers, and so their JIRA connections, database
+engines and metadata, between polls. Polls run one after another, the
+pause between them grows while nothing changes in JIRA.
+"""
+
+import errno
+import logging
+import os
+import random
+import signal
+import sys
+import time
+
+from daemon import DaemonContext
+from daemon.pidlockfile import PIDLockFile
+from lockfile import AlreadyLocked, LockTimeout
+
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlRunning(Exception):
+    pass
+
+
+def lock_file(path):
+    """Returns lock of the PID file breaking it if its process is gone"""
+    lock = PIDLockFile(os.path.abspath(path))
+    pid = lock.read_pid()
+    if pid is not None:
+        try:
+            os.kill(pid, 0)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                raise
+            logger.warn("Breaking stale lock %s of process %s", path, pid)
+            lock.break_lock()
+        else:
+            raise CrawlRunning("Crawler is already running with PID %s, see %s" % (pid, path))
+    return lock
+
+
+def acquire(lock):
+    try:
+        lock.acquire(timeout=0)
+    except (AlreadyLocked, LockTimeout):
+        raise CrawlRunning("Crawler is already running, see %s" % lock.path)
+
+
+class Poller(object):
+    """Crawls projects over and over
+
+    crawl(crawler) returns True when it found changes in JIRA. The pause
+    after a poll starts at interval seconds and doubles after every poll
+    which found nothing up to max_interval. Pauses are randomly stretched
+    or shrunk by jitter fraction so daemons don't poll JIRA in lockstep.
+    report is called with crawl stats of the projects after every poll.
+    """
+
+    def __init__(self, crawlers, crawl, report, interval=300, max_interval=3600, jitter=0.1):
+        self.crawlers = crawlers
+        self.crawl = crawl
+        self.report = report
+        self.interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.jitter = jitter
+        self.pause = interval
+
+    def poll(self):
+        """Crawls all projects once, returns True if any of them changed"""
+        results = self.crawlers.crawl(self.crawl)
+        self.report([crawler.stats for (crawler, changed) in results])
+        return any(changed for (crawler, changed) in results)
+
+    def next_pause(self, changed):
+        if changed:
+            self.pause = self.interval
+        else:
+            self.pause = min(self.pause * 2, self.max_interval)
+        return self.pause * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    changed = self.poll()
+                except Exception:
+                    logger.exception("Poll failed")
+                    changed = False
+                pause = self.next_pause(changed)
+                logger.info("Next poll in %d seconds", pause)
+                time.sleep(pause)
+        finally:
+            self.crawlers.close()
+
+
+def run_daemon(poller, lock_path, foreground=False, log_stream=None):
+    """Runs poller holding the lock, detached from terminal unless foreground"""
+    lock = lock_file(lock_path)
+    if foreground:
+        acquire(lock)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            poller.run()
+        finally:
+            lock.release()
+        return
+
+    # Relative paths in profiles, e.g. SQLite databases, stay valid. Files
+    # the daemon creates are readable by others, DaemonContext defaults to
+    # umask 0 which would make them writable too
+    context = DaemonContext(pidfile=lock, working_directory=os.getcwd(), umask=0o022,
+        files_preserve=[log_stream] if log_stream else None)
+    with context:
+        poller.run()
@@ -0,0 +1,234 @@
+"""Columnar snapshot of the crawled database
+
+Issues, versions and statuses are written into one file each, worklogs
+into one file per month of their creation under worklogs/month=YYYY-MM,
+so the snapshot reads as a Hive partitioned dataset. Issues and worklogs
+carry names of their versions and statuses and keys of their top-level
+tasks, so analytics need no joins. Files are Arrow IPC, which is read
+memory mapped, or Parquet. Crawls rewrite the worklog partitions of the
+months they touched, snapshot.json is written last and a snapshot
+without it is rebuilt from scratch.
+"""
+
+import json
+import os
+import shutil
+from datetime import datetime
+from itertools import islice
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import and_, func, select
+
+from jiracrawler.model import Issue, Status, Version, Worklog
+from jiracrawler.stats import write_atomically
+
+
+# Rows converted to columns at once
+SNAPSHOT_BATCH = 10000
+
+FORMATS = ('arrow', 'parquet')
+
+VERSION_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('name', pa.string()),
+    ('release_date', pa.date32()),
+    ('archived', pa.bool_()),
+])
+
+STATUS_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('name', pa.string()),
+])
+
+ISSUE_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('key', pa.string()),
+    ('type', pa.string()),
+    ('subtask', pa.bool_()),
+    ('summary', pa.string()),
+    ('assignee', pa.string()),
+    ('created_at', pa.timestamp('s')),
+    ('updated_at', pa.timestamp('s')),
+    ('due_date', pa.date32()),
+    ('status_id', pa.int64()),
+    ('status', pa.string()),
+    ('fix_version_id', pa.int64()),
+    ('version', pa.string()),
+    ('parent_id', pa.int64()),
+    ('parent_key', pa.string()),
+    ('task_id', pa.int64()),
+    ('task_key', pa.string()),
+])
+
+WORKLOG_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('created_at', pa.timestamp('s')),
+    ('author', pa.string()),
+    ('time_spent', pa.int64()),
+    ('issue_id', pa.int64()),
+    ('issue_key', pa.string()),
+    ('status', pa.string()),
+    ('fix_version_id', pa.int64()),
+    ('version', pa.string()),
+    ('task_id', pa.int64()),
+    ('task_key', pa.string()),
+])
+
+
+def month_start(date):
+    return datetime(date.year, date.month, 1)
+
+
+def next_month(start):
+    if start.month == 12:
+        return datetime(start.year + 1, 1, 1)
+    return datetime(start.year, start.month + 1, 1)
+
+
+def month_name(start):
+    return start.strftime('%Y-%m')
+
+
+def write_rows(path, schema, rows, format):
+    """Writes rows as a file of the format, readers never see it half written"""
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    if format == 'parquet':
+        writer = pq.ParquetWriter(tmp_path, schema)
+    else:
+        writer = pa.RecordBatchFileWriter(tmp_path, schema)
+    try:
+        rows = iter(rows)
+        for batch in iter(lambda: list(islice(rows, SNAPSHOT_BATCH)), []):
+            columns = zip(*batch)
+            writer.write_table(pa.Table.from_arrays([pa.array(list(values), type=field.type)
+                for (values, field) in zip(columns, schema)], schema=schema))
+    finally:
+        writer.close()
+    os.rename(tmp_path, path)
+
+
+def issue_rows(session):
+    issue = Issue.__table__
+    parent = issue.alias('parent')
+    versions = Version.__table__
+    statuses = Status.__table__
+    return session.execute(select([issue.c.id, issue.c.key, issue.c.type, issue.c.subtask,
+            issue.c.summary, issue.c.assignee, issue.c.created_at, issue.c.updated_at,
+            issue.c.due_date, issue.c.status_id, statuses.c.name, issue.c.fix_version_id,
+            versions.c.name, issue.c.parent_id, parent.c.key,
+            func.coalesce(issue.c.parent_id, issue.c.id), func.coalesce(parent.c.key, issue.c.key)],
+        from_obj=[issue.outerjoin(parent, parent.c.id == issue.c.parent_id)\
+            .outerjoin(statuses, statuses.c.id == issue.c.status_id)\
+            .outerjoin(versions, versions.c.id == issue.c.fix_version_id)])\
+        .order_by(issue.c.id))
+
+
+def worklog_rows(session, start, end):
+    """Returns worklogs created between start and end with attributes of their issues"""
+    worklog = Worklog.__table__
+    issue = Issue.__table__
+    parent = issue.alias('parent')
+    versions = Version.__table__
+    statuses = Status.__table__
+    return session.execute(select([worklog.c.id, worklog.c.created_at, worklog.c.author,
+            worklog.c.time_spent, worklog.c.issue_id, issue.c.key, statuses.c.name,
+            issue.c.fix_version_id, versions.c.name, func.coalesce(issue.c.parent_id, issue.c.id),
+            func.coalesce(parent.c.key, issue.c.key)],
+        and_(worklog.c.created_at >= start, worklog.c.created_at < end),
+        from_obj=[worklog.join(issue, issue.c.id == worklog.c.issue_id)\
+            .outerjoin(parent, parent.c.id == issue.c.parent_id)\
+            .outerjoin(statuses, statuses.c.id == issue.c.status_id)\
+            .outerjoin(versions, versions.c.id == issue.c.fix_version_id)])\
+        .order_by(worklog.c.created_at, worklog.c.id))
+
+
+def worklog_months(session):
+    """Returns starts of all months with worklogs"""
+    worklog = Worklog.__table__
+    (first, last) = session.execute(select([func.min(worklog.c.created_at),
+        func.max(worklog.c.created_at)])).fetchone()
+    months = []
+    if first is None:
+        return months
+    start = month_start(first)
+    while start <= last:
+        months.append(start)
+        start = next_month(start)
+    return months
+
+
+def write_month(session, path, start, format):
+    """Rewrites worklog partition of the month, returns False if the month has no worklogs"""
+    directory = os.path.join(path, 'worklogs', 'month=%s' % month_name(start))
+    rows = worklog_rows(session, start, next_month(start))
+    first = rows.fetchone()
+    if first is None:
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        return False
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    def all_rows():
+        yield first
+        for row in rows:
+            yield row
+    write_rows(os.path.join(directory, 'part-0.%s' % format), WORKLOG_SCHEMA,
+        all_rows(), format)
+    return True
+
+
+def snapshot_complete(path):
+    return os.path.exists(os.path.join(path, 'snapshot.json'))
+
+
+def write_snapshot(session, path, project_name, format='arrow', dates=None):
+    """Writes snapshot of the database into directory path
+
+    Only worklog partitions of months of the dates are rewritten, all of
+    them when dates is None or the snapshot is incomplete. Returns number
+    of rewritten partitions.
+    """
+    if format not in FORMATS:
+        raise ValueError("Unknown snapshot format %s, use arrow or parquet" % format)
+    manifest_path = os.path.join(path, 'snapshot.json')
+    manifest = None
+    if snapshot_complete(path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        # The snapshot is incomplete until the manifest is written again
+        os.remove(manifest_path)
+    if manifest is None or manifest['format'] != format:
+        dates = None
+    if not os.path.exists(path):
+        os.makedirs(path)
+    if dates is None and os.path.exists(os.path.join(path, 'worklogs')):
+        shutil.rmtree(os.path.join(path, 'worklogs'))
+
+    version = Version.__table__
+    status = Status.__table__
+    write_rows(os.path.join(path, 'versions.%s' % format), VERSION_SCHEMA,
+        session.execute(select([version.c.id, version.c.name, version.c.release_date,
+            version.c.archived]).order_by(version.c.id)), format)
+    write_rows(os.path.join(path, 'statuses.%s' % format), STATUS_SCHEMA,
+        session.execute(select([status.c.id, status.c.name]).order_by(status.c.id)), format)
+    write_rows(os.path.join(path, 'issues.%s' % format), ISSUE_SCHEMA,
+        issue_rows(session), format)
+
+    if dates is None:
+        (months, touched) = (set(), worklog_months(session))
+    else:
+        (months, touched) = (set(manifest['months']),
+            sorted(set(month_start(date) for date in dates)))
+    for start in touched:
+        if write_month(session, path, start, format):
+            months.add(month_name(start))
+        else:
+            months.discard(month_name(start))
+
+    write_atomically(manifest_path, json.dumps({'project': project_name, 'format': format,
+        'written_at': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+        'months': sorted(months)}, indent=2))
+    return len(touched)
@@ -0,0 +1,227 @@
+"""Crawl instrumentation: phase timings, JIRA calls and SQL statements"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from jiracrawler.throttle import transient
+
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomically(path, content):
+    """Writes file so that readers never see it half written"""
+    tmp_path = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.rename(tmp_path, path)
+
+
+def prometheus_labels(labels):
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for (name, value) in sorted(labels.items()) if value is not None)
+
+
+class CrawlStats(object):
+    """Collects measurements of a crawl, safe to use from several threads"""
+
+    def __init__(self, project_name=None):
+        self.project_name = project_name
+        # Throttle of JIRA calls, reported along with the crawl
+        self.throttle = None
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Starts measuring a new crawl, e.g. the next poll of a daemon"""
+        with self.lock:
+            self.started = time.time()
+            self.finished = None
+            self.phases = []
+            self.rpc = {}
+            # Rows written and found unchanged by table and version
+            self.rows = {}
+            self.sql_statements = 0
+            self.sql_seconds = 0.0
+
+    @contextmanager
+    def phase(self, name, version=None):
+        started = time.time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases.append({'phase': name, 'version': version,
+                    'seconds': time.time() - started})
+
+    def count_rpc(self, method, seconds, failed=False, retried=False, waited=0.0):
+        """Counts a JIRA call which took seconds after waiting for the throttle"""
+        with self.lock:
+            rpc = self.rpc.setdefault(method, {'calls': 0, 'seconds': 0.0, 'errors': 0,
+                'retries': 0, 'wait_seconds': 0.0})
+            rpc['calls'] += 1
+            rpc['seconds'] += seconds
+            rpc['wait_seconds'] += waited
+            if failed:
+                rpc['errors'] += 1
+            if retried:
+                rpc['retries'] += 1
+
+    def count_rows(self, table, version, changed):
+        with self.lock:
+            rows = self.rows.setdefault((table, version), {'changed': 0, 'unchanged': 0})
+            rows['changed' if changed else 'unchanged'] += 1
+
+    def watch_engine(self, engine):
+        """Counts and times SQL statements executed by the engine"""
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('query_started', []).append(time.time())
+
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            seconds = time.time() - conn.info['query_started'].pop()
+            with self.lock:
+                self.sql_statements += 1
+                self.sql_seconds += seconds
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+    def finish(self):
+        self.finished = time.time()
+
+    def rpc_calls(self):
+        return sum(rpc['calls'] for rpc in self.rpc.values())
+
+    def report(self):
+        with self.lock:
+            report = {
+                'project': self.project_name,
+                'started': self.started,
+                'seconds': (self.finished or time.time()) - self.started,
+                'phases': list(self.phases),
+                'rpc': dict((method, dict(rpc)) for (method, rpc) in self.rpc.items()),
+                'rows': [dict(rows, table=table, version=version)
+                    for ((table, version), rows) in sorted(self.rows.items())],
+                'sql': {'statements': self.sql_statements, 'seconds': self.sql_seconds},
+            }
+        if self.throttle:
+            report['throttle'] = self.throttle.report()
+        return report
+
+    def samples(self):
+        """Yields (metric, type, labels, value) of the crawl for Prometheus"""
+        report = self.report()
+        project = {'project': self.project_name}
+        yield ('jiracrawler_crawl_seconds', 'gauge', project, report['seconds'])
+        yield ('jiracrawler_crawl_finished_timestamp_seconds', 'gauge', project,
+            self.finished or time.time())
+
+        phases = {}
+        for phase in report['phases']:
+            key = (phase['phase'], phase['version'])
+            phases[key] = phases.get(key, 0) + phase['seconds']
+        for ((name, version), seconds) in sorted(phases.items()):
+            yield ('jiracrawler_phase_seconds', 'gauge',
+                dict(project, phase=name, version=version), seconds)
+
+        for (metric, field) in (('rpc_calls_total', 'calls'), ('rpc_seconds_total', 'seconds'),
+                ('rpc_errors_total', 'errors'), ('rpc_retries_total', 'retries'),
+                ('rpc_wait_seconds_total', 'wait_seconds')):
+            for (method, rpc) in sorted(report['rpc'].items()):
+                yield ('jiracrawler_%s' % metric, 'counter', dict(project, method=method),
+                    rpc[field])
+
+        for (metric, field) in (('rows_changed_total', 'changed'),
+                ('rows_unchanged_total', 'unchanged')):
+            for rows in report['rows']:
+                yield ('jiracrawler_%s' % metric, 'counter',
+                    dict(project, table=rows['table'], version=rows['version']), rows[field])
+
+        yield ('jiracrawler_sql_statements_total', 'counter', project,
+            report['sql']['statements'])
+        yield ('jiracrawler_sql_seconds_total', 'counter', project, report['sql']['seconds'])
+
+        if 'throttle' in report:
+            throttle = report['throttle']
+            yield ('jiracrawler_jira_concurrency_limit', 'gauge', project, throttle['concurrency'])
+            yield ('jiracrawler_jira_rate_limit', 'gauge', project, throttle['rate'])
+            for (method, latency) in sorted(throttle['latency'].items()):
+                yield ('jiracrawler_jira_latency_seconds', 'gauge', dict(project, method=method),
+                    latency)
+
+
+def prometheus_text(stats):
+    """Returns metrics of crawls in Prometheus text format"""
+    metrics = {}
+    order = []
+    for crawl_stats in stats:
+        for (metric, metric_type, labels, value) in crawl_stats.samples():
+            if metric not in metrics:
+                metrics[metric] = (metric_type, [])
+                order.append(metric)
+            metrics[metric][1].append('%s%s %s' % (metric, prometheus_labels(labels), value))
+
+    lines = []
+    for metric in order:
+        (metric_type, samples) = metrics[metric]
+        lines.append('# TYPE %s %s' % (metric, metric_type))
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(stats, path):
+    write_atomically(path, prometheus_text(stats))
+
+
+def write_json(stats, path):
+    write_atomically(path, json.dumps([crawl_stats.report() for crawl_stats in stats], indent=2))
+
+
+class InstrumentedService(object):
+    """Proxy to JIRA service timing every call
+
+    Calls are paced by the throttle and retried after transient errors.
+    """
+
+    def __init__(self, service, stats, throttle):
+        self.service = service
+        self.stats = stats
+        self.throttle = throttle
+
+    def __getattr__(self, name):
+        method = getattr(self.service, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            attempt = 0
+            while True:
+                waited = self.throttle.acquire()
+                started = time.time()
+                try:
+                    result = method(*args, **kwargs)
+                except Exception, e:
+                    seconds = time.time() - started
+                    self.throttle.release(name, seconds, failed=transient(e))
+                    retry = transient(e) and attempt < self.throttle.retries
+                    self.stats.count_rpc(name, seconds, failed=True, retried=retry,
+                        waited=waited)
+                    if not retry:
+                        raise
+                    pause = self.throttle.pause(attempt, e)
+                    logger.warn("JIRA call %s failed with %s, retrying in %.1f seconds",
+                        name, e, pause)
+                    time.sleep(pause)
+                    attempt += 1
+                    continue
+                seconds = time.time() - started
+                self.throttle.release(name, seconds)
+                self.stats.count_rpc(name, seconds, waited=waited)
+                return result
+        return call
@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import struct
+
+from sqlalchemy import bindparam, select, text
+
+
+logger = logging.getLogger(__name__)
+
+# Bind parameters per statement, SQLite refuses statements with more of
+# them and the other databases are fine with batches of that size
+MAX_PARAMETERS = 999
+
+
+def fingerprint(row):
+    """Returns signed 64 bit hash of the row's values, stored to tell unchanged rows
+
+    Values are hashed as text, so SOAP and REST backends, which return
+    byte and unicode strings or ints and longs, agree on fingerprints.
+    """
+    values = []
+    for (name, value) in sorted(row.items()):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        values.append('%s=%s' % (name, value))
+    digest = hashlib.md5('\0'.join(values)).digest()
+    return struct.unpack('<q', digest[:8])[0]
+
+
+def upsert_statement(dialect, table, columns, rows):
+    """Returns multi-row INSERT statement updating rows which already exist"""
+    preparer = dialect.identifier_preparer
+    names = [preparer.quote_identifier(c) for c in columns]
+
+    values = []
+    bindparams = []
+    params = {}
+    for (i, row) in enumerate(rows):
+        placeholders = []
+        for c in columns:
+            name = '%s_%d' % (c, i)
+            placeholders.append(':%s' % name)
+            bindparams.append(bindparam(name, type_=table.c[c].type))
+            params[name] = row[c]
+        values.append('(%s)' % ', '.join(placeholders))
+
+    updates = [n for (n, c) in zip(names, columns) if not table.c[c].primary_key]
+    keys = [preparer.quote_identifier(c.name) for c in table.primary_key]
+    if dialect.name == 'mysql':
+        if updates:
+            sql = 'INSERT INTO %s (%s) VALUES %s ON DUPLICATE KEY UPDATE %s' % (
+                preparer.format_table(table), ', '.join(names), ', '.join(values),
+                ', '.join('%s = VALUES(%s)' % (n, n) for n in updates))
+        else:
+            sql = 'INSERT IGNORE INTO %s (%s) VALUES %s' % (
+                preparer.format_table(table), ', '.join(names), ', '.join(values))
+    else:
+        if updates:
+            action = 'DO UPDATE SET %s' % ', '.join('%s = excluded.%s' % (n, n) for n in updates)
+        else:
+            action = 'DO NOTHING'
+        sql = 'INSERT INTO %s (%s) VALUES %s ON CONFLICT (%s) %s' % (
+            preparer.format_table(table), ', '.join(names), ', '.join(values),
+            ', '.join(keys), action)
+
+    return (text(sql, bindparams=bindparams), params)
+
+
+class BulkWriter(object):
+    """Buffers rows and writes them with batched upserts
+
+    MySQL and SQLite get multi-row upsert statements, other databases get
+    a lookup of existing keys followed by executemany INSERT and UPDATE.
+    Tables are flushed in the order they are given, so rows referenced by
+    foreign keys should come first.
+    """
+
+    def __init__(self, session, tables, batch_size=500):
+        self.session = session
+        self.tables = tables
+        self.batch_size = batch_size
+        self.rows = dict((table, []) for table in tables)
+
+    def add(self, table, row):
+        self.rows[table].append(row)
+        if len(self.rows[table]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # ORM objects like versions and statuses may be referenced by the rows
+        self.session.flush()
+        for table in self.tables:
+            if self.rows[table]:
+                self.write(table, self.rows[table])
+                self.rows[table] = []
+
+    def write(self, table, rows):
+        dialect = self.session.bind.dialect
+        columns = sorted(rows[0].keys())
+        if dialect.name == 'mysql':
+            self.session.execute(*upsert_statement(dialect, table, columns, rows))
+        elif dialect.name == 'sqlite':
+            per_statement = max(MAX_PARAMETERS / len(columns), 1)
+            for i in range(0, len(rows), per_statement):
+                self.session.execute(*upsert_statement(dialect, table, columns,
+                    rows[i:i + per_statement]))
+        else:
+            self.insert_or_update(table, rows)
+
+    def insert_or_update(self, table, rows):
+        (key,) = table.primary_key
+        existing = set(e[0] for e in self.session.execute(
+            select([key]).where(key.in_([row[key.name] for row in rows]))))
+
+        new_rows = [row for row in rows if row[key.name] not in existing]
+        if new_rows:
+            self.session.execute(table.insert(), new_rows)
+
+        updated_rows = [dict(('_%s' % c, v) for (c, v) in row.items())
+            for row in rows if row[key.name] in existing]
+        if updated_rows:
+            self.session.execute(table.update()\
+                .where(key == bindparam('_%s' % key.name))\
+                .values(dict((c, bindparam('_%s' % c)) for c in rows[0] if c != key.name)),
+                updated_rows)
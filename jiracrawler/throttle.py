@@ -0,0 +1,179 @@
+"""Throttling and retrying of JIRA calls
+
+Calls of all connections of a crawler, and of crawlers of projects on
+the same JIRA server, go through one Throttle. It keeps the request rate
+under a token bucket and limits calls in flight. The limit grows while
+JIRA answers quickly and is halved when JIRA fails or slows down. Calls
+failing with transient errors are retried after exponentially growing,
+randomly jittered pauses.
+"""
+
+import httplib
+import logging
+import random
+import socket
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses of an overloaded or restarting server
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+
+# Latency of calls above this multiple of the lowest one means JIRA is overloaded
+LATENCY_TOLERANCE = 2.0
+
+# Calls faster than that are never considered slow
+LATENCY_FLOOR = 0.05
+
+# Weight of the latest call in the average latency
+LATENCY_WEIGHT = 0.1
+
+
+def http_status(error):
+    """Returns HTTP status of a failed REST or SOAP call, if any
+
+    suds raises TransportError with httpcode, or a plain Exception with a
+    (status, reason) tuple for HTTP errors other than SOAP faults.
+    """
+    response = getattr(error, 'response', None)
+    if response is not None and hasattr(response, 'status_code'):
+        return response.status_code
+    if isinstance(getattr(error, 'httpcode', None), int):
+        return error.httpcode
+    if len(error.args) == 1 and isinstance(error.args[0], tuple) and \
+            len(error.args[0]) == 2 and isinstance(error.args[0][0], int):
+        return error.args[0][0]
+    return None
+
+
+def transient(error):
+    """Tells if a failed call may succeed when repeated"""
+    status = http_status(error)
+    if status is not None:
+        return status in TRANSIENT_STATUSES
+    return isinstance(error, (IOError, socket.error, httplib.HTTPException))
+
+
+def retry_after(error):
+    """Returns pause in seconds the server asked for, if any"""
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers['Retry-After'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class Throttle(object):
+    """Paces JIRA calls of several threads
+
+    rate limits calls per second, 0 means no limit. Up to max_concurrency
+    calls run at once, the limit starts at one and adapts to JIRA
+    responses: it goes up by one after as many quick successful calls and
+    down by half after a transient error or when the average latency of a
+    method exceeds LATENCY_TOLERANCE times the lowest one seen. Failed
+    calls are retried up to retries times after pauses of up to
+    backoff * 2 ** attempt seconds, capped at max_backoff.
+    """
+
+    def __init__(self, rate=0, max_concurrency=16, retries=5, backoff=1.0, max_backoff=60.0):
+        self.rate = rate
+        self.max_concurrency = max(max_concurrency, 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.condition = threading.Condition()
+        self.tokens = max(rate, 1)
+        self.refilled = time.time()
+        # Calls start one at a time, so the lowest latencies are measured
+        # before JIRA gets any load from the crawler
+        self.concurrency = 1
+        self.running = 0
+        self.successes = 0
+        # Calls left before the limit may be lowered again
+        self.cooldown = 0
+        # Average and lowest average latency by method, searches take much
+        # longer than other calls
+        self.latencies = {}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(float(config.get('jira_rate', 0)), int(config.get('jira_concurrency', 16)),
+            int(config.get('jira_retries', 5)), float(config.get('jira_backoff', 1)),
+            float(config.get('jira_max_backoff', 60)))
+
+    def acquire(self):
+        """Waits for a free slot and a token, returns seconds spent waiting"""
+        started = time.time()
+        with self.condition:
+            while self.running >= self.concurrency:
+                self.condition.wait()
+            self.running += 1
+            while self.rate:
+                now = time.time()
+                self.tokens = min(self.tokens + (now - self.refilled) * self.rate,
+                    max(self.rate, 1))
+                self.refilled = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                # Other threads may go on while this one sleeps
+                self.condition.wait((1 - self.tokens) / self.rate)
+        return time.time() - started
+
+    def release(self, method, seconds, failed=False):
+        """Frees the slot of a call which took seconds, adapting the limit
+
+        failed is set for calls failed with transient errors.
+        """
+        with self.condition:
+            self.running -= 1
+            self.cooldown = max(self.cooldown - 1, 0)
+            if failed:
+                self.slow_down("JIRA call failed")
+            else:
+                self.measure(method, seconds)
+            self.condition.notify_all()
+
+    def measure(self, method, seconds):
+        if method in self.latencies:
+            (latency, lowest) = self.latencies[method]
+            latency += (seconds - latency) * LATENCY_WEIGHT
+        else:
+            (latency, lowest) = (seconds, seconds)
+        if self.running == 0 and self.concurrency == 1:
+            # Calls made alone show latency of JIRA without load of the
+            # crawler, so a JIRA which got slower for good isn't throttled forever
+            lowest += (seconds - lowest) * LATENCY_WEIGHT
+        self.latencies[method] = (latency, min(latency, lowest))
+
+        if latency > max(lowest * LATENCY_TOLERANCE, LATENCY_FLOOR):
+            self.slow_down("Latency of %s grew to %.2f seconds" % (method, latency))
+            return
+        self.successes += 1
+        if self.successes >= self.concurrency and self.concurrency < self.max_concurrency:
+            self.concurrency += 1
+            self.successes = 0
+
+    def slow_down(self, reason):
+        self.successes = 0
+        # Calls started before the limit went down shouldn't lower it again
+        if self.cooldown or self.concurrency == 1:
+            return
+        self.concurrency = max(self.concurrency / 2, 1)
+        self.cooldown = self.running + self.concurrency
+        logger.info("%s, making at most %s concurrent JIRA calls", reason, self.concurrency)
+
+    def pause(self, attempt, error):
+        """Returns seconds to wait before repeating a call failed attempt times"""
+        pause = random.uniform(0, min(self.backoff * 2 ** attempt, self.max_backoff))
+        return max(pause, retry_after(error) or 0)
+
+    def report(self):
+        with self.condition:
+            return {'rate': self.rate, 'concurrency': self.concurrency,
+                'max_concurrency': self.max_concurrency,
+                'latency': dict((method, latency) for (method, (latency, lowest))
+                    in self.latencies.items())}
@@ -17,15 +17,20 @@ setup(
         'MySQL-python>=1.2.2',
         'lockfile==0.8',
         'python-daemon==1.5.5',
+        'requests',
         'sqlalchemy==0.7.3',
         'SOAPpy==0.12.5'
     ],
+    extras_require={
+        'snapshot': ['pyarrow'],
+    },
     dependency_links=[
         "https://github.com/aklochkovgd/jirareports/tarball/master#egg=jirareports"
     ],
     entry_points={
         'console_scripts': [
-            'jiracrawler=jiracrawler.crawler:main'
+            'jiracrawler=jiracrawler.crawler:main',
+            'jiracrawler-bench=jiracrawler.bench:main'
         ]
     }
 )
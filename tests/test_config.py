@@ -0,0 +1,34 @@
+"""Profiles read from the JIRA configuration file"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from jiracrawler.config import read_profiles
+
+
+class ReadProfilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='jiracrawler-test-')
+        self.path = os.path.join(self.workdir, 'jira')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_values_are_read_as_written(self):
+        with open(self.path, 'w') as f:
+            f.write("[default]\nuri = http://jira.example.com\nusername = crawler\n"
+                "password = 50%off\n\n[INTPRJ]\nproject = INTPRJ\ndb_url = sqlite:///%(project)s.db\n")
+        profiles = read_profiles(self.path)
+        self.assertEqual(sorted(profiles), ['INTPRJ', 'default'])
+        self.assertEqual(profiles['default']['password'], '50%off')
+        self.assertEqual(profiles['INTPRJ']['db_url'], 'sqlite:///%(project)s.db')
+
+    def test_missing_file(self):
+        self.assertEqual(read_profiles(os.path.join(self.workdir, 'missing')), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+"""Crawls of projects served by FakeJiraService into SQLite databases"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import timedelta
+
+from jiracrawler.crawler import JiraCrawler
+from jiracrawler.fake import FakeJiraConnection, FakeJiraService, synthetic_project
+
+
+class CrawlTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='jiracrawler-test-')
+        self.db_path = os.path.join(self.workdir, 'test.db')
+        self.fixture = synthetic_project(issues=300, versions=3)
+        self.options = {'page_size': '40'}
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def crawl(self, full=False, service=None, **options):
+        """Crawls the fixture, returns JIRA calls of the crawl by method"""
+        service = service or FakeJiraService(self.fixture)
+        config = dict(self.options, db_url='sqlite:///%s' % self.db_path, **options)
+        crawler = JiraCrawler(connect=lambda: self.connection(service, config))
+        self.crawler = crawler
+        try:
+            crawler.crawl(full=full)
+        finally:
+            crawler.close()
+            crawler.session.close()
+            crawler.engine.dispose()
+        return service.calls
+
+    def connection(self, service, config):
+        return FakeJiraConnection(service, config)
+
+    def worklog_fetches(self, keys):
+        """Returns number of worklog fetches needed for the issues"""
+        return len(keys)
+
+    def query(self, sql):
+        db = sqlite3.connect(self.db_path)
+        try:
+            return sorted(db.execute(sql))
+        finally:
+            db.close()
+
+    def issue(self, key):
+        return [issue for issue in self.fixture['issues'] if issue['key'] == key][0]
+
+    def touch(self, key):
+        """Makes the issue the latest updated one"""
+        issue = self.issue(key)
+        issue['updated'] = max(i['updated'] for i in self.fixture['issues']) + timedelta(hours=1)
+        return issue
+
+    def dump(self):
+        """Returns stored issues, worklogs and rollups"""
+        return (self.query('select id, key, fix_version_id, parent_id, status_id, summary '
+                'from issue'),
+            self.query('select id, issue_id, created_at, author, time_spent from worklog'),
+            self.query('select date, version_id, author, time_spent from dailyauthorwork'),
+            self.query('select date, task_id, time_spent from dailytaskwork'))
+
+    def stored_parents(self):
+        return dict(self.query('select s.key, p.key from issue s join issue p on p.id = s.parent_id'))
+
+    def assertHierarchy(self):
+        self.assertEqual(self.stored_parents(), self.fixture['parents'])
+
+    def sibling(self, subtask):
+        """Returns a task stored in the same version as the parent of the subtask"""
+        parent = self.fixture['parents'][subtask]
+        versions = dict(self.query('select key, fix_version_id from issue where subtask = 0'))
+        return [key for (key, version) in sorted(versions.items())
+            if version == versions[parent] and key != parent][0]
+
+
+class CrawlTest(CrawlTestCase):
+
+    def assertStored(self):
+        """Checks that the database holds the fixture"""
+        expected = dict((issue['key'], (max([int(v['id']) for v in issue['fixVersions']] or
+                [None]), int(issue['status']), issue['summary']))
+            for issue in self.fixture['issues'])
+        stored = dict((key, (version_id, status_id, summary)) for
+            (id, key, version_id, parent_id, status_id, summary) in self.dump()[0])
+        self.assertEqual(stored, expected)
+
+        expected = sorted((int(worklog['id']), key, worklog['timeSpentInSeconds'])
+            for (key, worklogs) in self.fixture['worklogs'].items() for worklog in worklogs)
+        self.assertEqual(self.query('select w.id, i.key, w.time_spent from worklog w '
+            'join issue i on i.id = w.issue_id'), expected)
+        self.assertHierarchy()
+
+        self.assertEqual(self.query('select date, task_id, time_spent from dailytaskwork'),
+            self.query('select date(w.created_at), coalesce(i.parent_id, i.id), '
+                'sum(w.time_spent) from worklog w join issue i on i.id = w.issue_id '
+                'group by 1, 2'))
+        self.assertEqual(self.query('select date, version_id, author, time_spent '
+                'from dailyauthorwork'),
+            self.query('select date(w.created_at), i.fix_version_id, w.author, '
+                'sum(w.time_spent) from worklog w join issue i on i.id = w.issue_id '
+                'group by 1, 2, 3'))
+
+    def test_full_crawl(self):
+        self.crawl(full=True)
+        self.assertStored()
+
+    def test_incremental_crawl(self):
+        self.crawl(full=True)
+        moved = self.touch('BENCH-20')
+        moved['fixVersions'] = [dict(self.fixture['versions'][-1])]
+        closed = self.touch('BENCH-30')
+        closed['status'] = '6' if closed['status'] != '6' else '1'
+        closed['summary'] = 'Closed issue'
+        logged = self.touch('BENCH-40')
+        self.fixture['worklogs']['BENCH-40'].append({'id': '99999', 'author': 'developer1',
+            'created': logged['updated'], 'timeSpentInSeconds': 1800})
+
+        calls = self.crawl()
+        self.assertStored()
+        self.assertEqual(calls.get('getWorklogs', 0),
+            self.worklog_fetches(['BENCH-20', 'BENCH-30', 'BENCH-40']))
+
+    def test_update_alone_touches_no_days(self):
+        self.crawl(full=True)
+        key = [key for (key, worklogs) in sorted(self.fixture['worklogs'].items()) if worklogs][0]
+        self.touch(key)
+
+        self.crawl()
+        self.assertStored()
+        self.assertEqual(self.crawler.touched_dates, set())
+
+    def test_status_change_touches_days_of_worklogs(self):
+        self.crawl(full=True)
+        key = [key for (key, worklogs) in sorted(self.fixture['worklogs'].items()) if worklogs][0]
+        issue = self.touch(key)
+        issue['status'] = '6' if issue['status'] != '6' else '1'
+
+        self.crawl()
+        self.assertStored()
+        self.assertEqual(self.crawler.touched_dates, set(worklog['created'].date()
+            for worklog in self.fixture['worklogs'][key]))
+
+    def test_repeated_crawl_changes_nothing(self):
+        self.crawl(full=True)
+        stored = self.dump()
+        calls = self.crawl()
+        self.assertEqual(self.dump(), stored)
+        self.assertFalse(calls.get('getWorklogs'))
+
+    def test_removal(self):
+        self.options['tombstones'] = 'true'
+        self.crawl(full=True)
+        key = [issue['key'] for issue in self.fixture['issues']
+            if self.fixture['worklogs'][issue['key']] and
+                issue['key'] not in self.fixture['parents'].values()][0]
+        self.fixture['issues'] = [issue for issue in self.fixture['issues']
+            if issue['key'] != key]
+        del self.fixture['worklogs'][key]
+        self.fixture['parents'].pop(key, None)
+
+        self.crawl(full=True)
+        self.assertStored()
+        self.assertEqual(self.query('select key from issuetombstone'), [(key,)])
+
+    def test_resume_interrupted_crawl(self):
+        self.options.update(checkpoint_size='10', jira_retries='0')
+        self.crawl(full=True)
+        expected = self.dump()
+        os.remove(self.db_path)
+
+        service = FakeJiraService(self.fixture)
+        search = service.getIssuesFromJqlSearch
+        def getIssuesFromJqlSearch(auth, jql, max_results):
+            # Fails in the middle of a version, after a checkpoint
+            if self.query('select * from crawlcheckpoint where done = 0'):
+                raise RuntimeError("JIRA went away")
+            return search(auth, jql, max_results)
+        service.getIssuesFromJqlSearch = getIssuesFromJqlSearch
+        self.assertRaises(RuntimeError, self.crawl, True, service)
+        self.assertTrue(self.query('select * from crawlcheckpoint where done = 0'))
+
+        self.crawl()
+        self.assertEqual(self.dump(), expected)
+        self.assertFalse(self.query('select * from crawlcheckpoint'))
+        # Issues stored before the interruption aren't fetched again
+        fetched = sum(rows['changed'] + rows['unchanged']
+            for ((table, version), rows) in self.crawler.stats.rows.items() if table == 'issue')
+        self.assertTrue(fetched < len(self.fixture['issues']))
+
+
+class HierarchyTest(CrawlTestCase):
+
+    def test_full_crawl(self):
+        self.crawl(full=True)
+        self.assertHierarchy()
+
+    def test_subtask_moved_within_batch(self):
+        self.options['hierarchy_batch'] = '1000'
+        self.crawl(full=True)
+        subtask = sorted(self.fixture['parents'])[0]
+        self.fixture['parents'][subtask] = self.sibling(subtask)
+        self.touch(subtask)
+
+        self.crawl(full=True)
+        self.assertHierarchy()
+
+    def test_subtasks_moved_by_incremental_crawl(self):
+        self.crawl(full=True)
+        (first, second) = sorted(self.fixture['parents'])[:2]
+        self.fixture['parents'][first] = self.sibling(first)
+        self.touch(first)
+        versions = dict(self.query('select key, fix_version_id from issue where subtask = 0'))
+        self.fixture['parents'][second] = [key for (key, version) in sorted(versions.items())
+            if version != versions[self.fixture['parents'][second]]][0]
+        self.touch(second)
+
+        self.crawl()
+        self.assertHierarchy()
+
+    def test_incremental_crawl_without_changes_searches_no_subtasks(self):
+        self.crawl(full=True)
+        calls = self.crawl()
+        # One search per version and one for issues without version
+        self.assertEqual(calls['getIssuesFromJqlSearch'], len(self.fixture['versions']) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
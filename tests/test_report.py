@@ -0,0 +1,70 @@
+"""Reports over a crawled database"""
+
+import csv
+import json
+import os
+import unittest
+
+from jiracrawler.report import REPORTS, main
+
+from test_crawler import CrawlTestCase
+
+
+class ReportTest(CrawlTestCase):
+
+    def setUp(self):
+        super(ReportTest, self).setUp()
+        self.crawl(full=True)
+        self.profiles = {'test': {'db_url': 'sqlite:///%s' % self.db_path}}
+        self.output = os.path.join(self.workdir, 'report')
+
+    def report(self, name, format, *args):
+        main([name, 'test', '--from', '2011-01-01', '--to', '2011-12-31', '--format', format,
+            '-o', self.output] + list(args), self.profiles)
+        with open(self.output) as f:
+            if format == 'json':
+                return json.load(f)
+            rows = list(csv.reader(f))
+            return [dict(zip(rows[0], row)) for row in rows[1:]]
+
+    def expected_rows(self):
+        return {
+            'developer-days': self.query('select count(*) from dailyauthorwork'),
+            'developers': self.query('select count(*) from '
+                '(select distinct version_id, author from dailyauthorwork)'),
+            'tasks': self.query('select count(*) from dailytaskwork'),
+            'worklogs': self.query('select count(*) from worklog'),
+        }
+
+    def test_reports(self):
+        hours = self.query('select sum(time_spent) / 3600.0 from worklog')[0][0]
+        for (name, [(count,)]) in sorted(self.expected_rows().items()):
+            self.assertTrue(count > 0, name)
+            for format in ('csv', 'json'):
+                rows = self.report(name, format)
+                self.assertEqual(len(rows), count, (name, format))
+                self.assertAlmostEqual(sum(float(row['hours']) for row in rows), hours,
+                    delta=0.01 * count)
+
+    def test_version(self):
+        rows = self.report('worklogs', 'json', '--version', '1.0')
+        self.assertEqual(len(rows), self.query('select count(*) from worklog w '
+            'join issue i on i.id = w.issue_id join version v on v.id = i.fix_version_id '
+            'where v.name = \'1.0\'')[0][0])
+        self.assertEqual(set(row['version'] for row in rows), set(['1.0']))
+
+    def test_empty_range(self):
+        main(['tasks', 'test', '--from', '2000-01-01', '-o', self.output], self.profiles)
+        with open(self.output) as f:
+            self.assertEqual(list(csv.reader(f)), [['date', 'version', 'key', 'summary',
+                'status', 'due_date', 'hours']])
+
+    def test_profile_without_database(self):
+        self.assertRaises(SystemExit, main, ['tasks', 'test'], {'test': {'uri': 'http://jira'}})
+
+    def test_unknown_report(self):
+        self.assertRaises(SystemExit, main, ['velocity', 'test'], self.profiles)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+"""Crawls through the REST backend of requests answered by FakeJiraService"""
+
+import unittest
+
+from jiracrawler.fake import FakeJiraService
+from jiracrawler.rest import RestConnection, RestService, rest_issue
+
+import test_crawler
+
+# Worklogs embedded in search results and returned per worklog request
+EMBEDDED_WORKLOGS = 3
+WORKLOG_PAGE = 2
+
+def rest_time(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.000+0200')
+
+
+def rest_version(version):
+    return {'id': version.id, 'name': version.name, 'releaseDate': version.releaseDate,
+        'archived': version.archived}
+
+
+def rest_worklog(worklog):
+    return {'id': worklog.id, 'author': {'name': worklog.author},
+        'created': rest_time(worklog.created), 'timeSpentSeconds': worklog.timeSpentInSeconds}
+
+
+class StubRestService(RestService):
+    """RestService answering requests from a FakeJiraService instead of HTTP
+
+    Like JIRA it embeds only some worklogs of issues in search results and
+    caps pages of searches and worklogs. Every search page counts as a
+    search of the fake service, every worklog page as a worklog fetch.
+    """
+
+    def __init__(self, fake, embedded_worklogs=EMBEDDED_WORKLOGS, search_page=15,
+            worklog_page=WORKLOG_PAGE):
+        RestService.__init__(self, 'http://jira.example.com/rpc/soap/jirasoapservice-v2',
+            'crawler', 'secret')
+        self.fake = fake
+        self.embedded_worklogs = embedded_worklogs
+        self.search_page = search_page
+        self.worklog_page = worklog_page
+
+    def issue(self, issue):
+        worklogs = self.fake.worklogs.get(issue.key, [])
+        fields = {
+            'issuetype': {'id': issue.type},
+            'status': {'id': issue.status},
+            'summary': issue.summary,
+            'assignee': {'name': issue.assignee} if issue.assignee else None,
+            'created': rest_time(issue.created),
+            'updated': rest_time(issue.updated),
+            'duedate': issue.duedate.strftime('%Y-%m-%d') if issue.duedate else None,
+            'fixVersions': [rest_version(v) for v in issue.fixVersions],
+            'worklog': {'startAt': 0, 'maxResults': self.embedded_worklogs,
+                'total': len(worklogs),
+                'worklogs': [rest_worklog(w) for w in worklogs[:self.embedded_worklogs]]},
+        }
+        parent = self.fake.parents.get(issue.key)
+        if parent:
+            fields['parent'] = {'id': self.fake.by_key[parent].id, 'key': parent}
+        return {'id': issue.id, 'key': issue.key, 'fields': fields}
+
+    def get(self, path, **params):
+        fake = self.fake
+        parts = path.split('/')
+        if path == 'status':
+            return [{'id': s.id, 'name': s.name} for s in fake.getStatuses(None)]
+        if parts[0] == 'project' and len(parts) == 3 and parts[2] == 'versions':
+            return [rest_version(v) for v in fake.getVersions(None, parts[1])]
+        if parts[0] == 'project' and len(parts) == 2:
+            project = fake.getProjectByKey(None, parts[1])
+            return {'id': project.id, 'key': project.key, 'name': project.name,
+                'issueTypes': [{'id': t.id, 'name': t.name, 'subtask': False}
+                        for t in fake.getIssueTypesForProject(None, project.id)] +
+                    [{'id': t.id, 'name': t.name, 'subtask': True}
+                        for t in fake.getSubTaskIssueTypesForProject(None, project.id)]}
+        if parts[0] == 'issue' and len(parts) == 3 and parts[2] == 'worklog':
+            worklogs = fake.getWorklogs(None, parts[1])
+            start = params.get('startAt', 0)
+            return {'startAt': start, 'maxResults': self.worklog_page, 'total': len(worklogs),
+                'worklogs': [rest_worklog(w) for w in worklogs[start:start + self.worklog_page]]}
+        raise ValueError("Unexpected request GET %s" % path)
+
+    def post(self, path, body):
+        if path != 'search':
+            raise ValueError("Unexpected request POST %s" % path)
+        issues = self.fake.getIssuesFromJqlSearch(None, body['jql'], 1000000)
+        start = body['startAt']
+        size = min(body['maxResults'], self.search_page)
+        return {'startAt': start, 'maxResults': size, 'total': len(issues),
+            'issues': [self.issue(issue) for issue in issues[start:start + size]]}
+
+
+class RestTestCase(object):
+    """Runs crawl tests through the REST backend"""
+
+    def setUp(self):
+        super(RestTestCase, self).setUp()
+        self.options['api'] = 'rest'
+
+    def connection(self, service, config):
+        connection = RestConnection(dict(config, project=service.project.key,
+            uri='http://jira.example.com/', username='crawler', password='secret'))
+        connection.service = StubRestService(service)
+        return connection
+
+    def worklog_fetches(self, keys):
+        """Pages of worklogs of the issues which don't fit into search results"""
+        pages = 0
+        for key in keys:
+            worklogs = len(self.fixture['worklogs'][key])
+            if worklogs > EMBEDDED_WORKLOGS:
+                pages += (worklogs + WORKLOG_PAGE - 1) / WORKLOG_PAGE
+        return pages
+
+
+class RestCrawlTest(RestTestCase, test_crawler.CrawlTest):
+
+    def test_worklogs_beyond_search_results(self):
+        key = [key for (key, worklogs) in sorted(self.fixture['worklogs'].items())
+            if len(worklogs) > EMBEDDED_WORKLOGS][0]
+        self.fixture['worklogs'][key].extend(dict(self.fixture['worklogs'][key][0],
+            id=str(90000 + i)) for i in range(6))
+
+        calls = self.crawl(full=True)
+        self.assertStored()
+        self.assertEqual(calls['getWorklogs'], self.worklog_fetches(
+            [issue['key'] for issue in self.fixture['issues']]))
+
+
+class RestHierarchyTest(RestTestCase, test_crawler.HierarchyTest):
+
+    def test_full_crawl_searches_no_subtasks(self):
+        service = FakeJiraService(self.fixture)
+        searches = []
+        search = service.getIssuesFromJqlSearch
+        def getIssuesFromJqlSearch(auth, jql, max_results):
+            searches.append(jql)
+            return search(auth, jql, max_results)
+        service.getIssuesFromJqlSearch = getIssuesFromJqlSearch
+
+        self.crawl(True, service)
+        self.assertHierarchy()
+        self.assertFalse([jql for jql in searches if 'parent' in jql])
+
+
+class RestIssueTest(unittest.TestCase):
+
+    def test_truncated_worklogs(self):
+        issue = rest_issue({'id': '10001', 'key': 'BENCH-1', 'fields': {
+            'issuetype': {'id': '5'}, 'status': {'id': '1'}, 'summary': 'Subtask',
+            'assignee': None, 'created': '2011-01-01T10:00:00.000+0200',
+            'updated': '2011-01-02T10:00:00.000+0200', 'duedate': '2011-02-01',
+            'fixVersions': [{'id': '10000', 'name': '1.0'}], 'parent': {'id': '10000'},
+            'worklog': {'total': 2, 'worklogs': [{'id': '1', 'author': {'name': 'developer1'},
+                'created': '2011-01-01T11:00:00.000+0200', 'timeSpentSeconds': 60}]}}})
+        self.assertEqual((issue.assignee, issue.parentId, issue.worklogs), (None, '10000', None))
+        self.assertEqual([(v.id, v.name, v.releaseDate, v.archived) for v in issue.fixVersions],
+            [('10000', '1.0', None, False)])
+
+    def test_embedded_worklogs(self):
+        issue = rest_issue({'id': '10001', 'key': 'BENCH-1', 'fields': {
+            'issuetype': {'id': '1'}, 'status': {'id': '1'}, 'summary': 'Task',
+            'assignee': {'name': 'developer2'}, 'created': '2011-01-01T10:00:00.000+0200',
+            'updated': '2011-01-02T10:00:00.000+0200', 'fixVersions': [],
+            'worklog': {'total': 1, 'worklogs': [{'id': '1', 'author': {'name': 'developer1'},
+                'created': '2011-01-01T11:00:00.000+0200', 'timeSpentSeconds': 60}]}}})
+        self.assertEqual((issue.assignee, issue.parentId, issue.duedate),
+            ('developer2', None, None))
+        self.assertEqual([tuple(w) for w in issue.worklogs],
+            [('1', 'developer1', '2011-01-01T11:00:00.000+0200', 60)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Columnar snapshots written by crawls"""
+
+import os
+import unittest
+from datetime import timedelta
+
+from test_crawler import CrawlTestCase
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+@unittest.skipUnless(pa, "pyarrow isn't installed")
+class SnapshotTest(CrawlTestCase):
+
+    def setUp(self):
+        super(SnapshotTest, self).setUp()
+        self.snapshot_dir = os.path.join(self.workdir, 'snapshot')
+        self.options.update(snapshot_dir=self.snapshot_dir, snapshot_format='arrow')
+
+    def partition_paths(self):
+        """Returns paths of worklog partitions by their months"""
+        directory = os.path.join(self.snapshot_dir, 'worklogs')
+        return dict((name[len('month='):], os.path.join(directory, name,
+                'part-0.%s' % self.options['snapshot_format']))
+            for name in os.listdir(directory))
+
+    def partitions(self):
+        """Returns numbers of rows of worklog partitions by their months"""
+        rows = {}
+        for (month, path) in self.partition_paths().items():
+            if self.options['snapshot_format'] == 'parquet':
+                rows[month] = pq.read_table(path).num_rows
+            else:
+                rows[month] = pa.ipc.open_file(pa.memory_map(path)).read_all().num_rows
+        return rows
+
+    def assertPartitions(self):
+        partitions = self.partitions()
+        self.assertEqual(sorted(partitions.items()), self.query(
+            'select substr(created_at, 1, 7), count(*) from worklog group by 1'))
+        self.assertEqual(sum(partitions.values()),
+            self.query('select count(*) from worklog')[0][0])
+
+    def test_full_crawl(self):
+        self.crawl(full=True)
+        self.assertPartitions()
+
+    def test_parquet(self):
+        self.options['snapshot_format'] = 'parquet'
+        self.crawl(full=True)
+        self.assertPartitions()
+
+    def test_incremental_crawl_rewrites_touched_months(self):
+        self.crawl(full=True)
+        for path in self.partition_paths().values():
+            os.utime(path, (0, 0))
+        # An issue with worklogs of a single month
+        key = [key for (key, worklogs) in sorted(self.fixture['worklogs'].items())
+            if len(set(worklog['created'].month for worklog in worklogs)) == 1][0]
+        issue = self.touch(key)
+        issue['status'] = '6' if issue['status'] != '6' else '1'
+        self.fixture['worklogs'][key].append({'id': '99999', 'author': 'developer1',
+            'created': self.fixture['worklogs'][key][0]['created'] + timedelta(minutes=1),
+            'timeSpentInSeconds': 1800})
+
+        self.crawl()
+        self.assertPartitions()
+        rewritten = sorted(month for (month, path) in self.partition_paths().items()
+            if os.stat(path).st_mtime != 0)
+        month = self.fixture['worklogs'][key][0]['created'].strftime('%Y-%m')
+        self.assertEqual(rewritten, [month])
+        self.assertTrue(len(self.partitions()) > 1)
+
+    def test_unchanged_crawl_rewrites_nothing(self):
+        self.crawl(full=True)
+        for path in self.partition_paths().values():
+            os.utime(path, (0, 0))
+
+        self.crawl()
+        self.assertPartitions()
+        self.assertFalse([path for path in self.partition_paths().values()
+            if os.stat(path).st_mtime != 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Retries of JIRA calls failing with transient errors"""
+
+import unittest
+
+from jiracrawler.stats import CrawlStats, InstrumentedService
+from jiracrawler.throttle import Throttle, transient
+
+
+class TransportError(Exception):
+    """Error suds raises for HTTP statuses of its transport"""
+
+    def __init__(self, reason, httpcode):
+        Exception.__init__(self, reason)
+        self.httpcode = httpcode
+
+
+class FlakyService(object):
+    """Service failing the first calls with the given errors"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def getIssue(self, auth, key):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return key
+
+
+class TransientTest(unittest.TestCase):
+
+    def test_suds_http_errors(self):
+        self.assertTrue(transient(Exception((503, 'Service Unavailable'))))
+        self.assertTrue(transient(TransportError('Bad Gateway', 502)))
+        self.assertFalse(transient(Exception((404, 'Not Found'))))
+        self.assertFalse(transient(TransportError('Forbidden', 403)))
+
+    def test_other_errors(self):
+        self.assertTrue(transient(IOError(104, 'Connection reset by peer')))
+        self.assertFalse(transient(Exception('Issue BENCH-1 does not exist')))
+        self.assertFalse(transient(ValueError(1, 2)))
+
+
+class RetryTest(unittest.TestCase):
+
+    def call(self, service):
+        stats = CrawlStats('BENCH')
+        jira = InstrumentedService(service, stats, Throttle(retries=2, backoff=0))
+        try:
+            return jira.getIssue(None, 'BENCH-1')
+        finally:
+            self.rpc = stats.rpc['getIssue']
+
+    def test_suds_unavailable_is_retried(self):
+        service = FlakyService(Exception((503, 'Service Unavailable')),
+            TransportError('Gateway Timeout', 504))
+        self.assertEqual(self.call(service), 'BENCH-1')
+        self.assertEqual(service.calls, 3)
+        self.assertEqual((self.rpc['errors'], self.rpc['retries']), (2, 2))
+
+    def test_retries_give_up(self):
+        service = FlakyService(*[Exception((503, 'Service Unavailable'))] * 3)
+        self.assertRaises(Exception, self.call, service)
+        self.assertEqual(service.calls, 3)
+
+    def test_permanent_error_is_not_retried(self):
+        service = FlakyService(Exception((404, 'Not Found')))
+        self.assertRaises(Exception, self.call, service)
+        self.assertEqual(service.calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()